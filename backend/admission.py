@@ -0,0 +1,102 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+class Overloaded(Exception):
+    """Raised instead of admitting a request; carries the HTTP status and a Retry-After in seconds"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(f'Server busy ({reason}), retry in {retry_after}s')
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded FIFO queue and a wait deadline.
+
+    At most `concurrency` callers hold a slot; up to `queue_depth` more wait
+    for one, in arrival order, for at most `queue_timeout` seconds. A caller
+    finding the queue full is turned away at once (429); one whose wait runs
+    out is turned away then (503). Either way the caller is told when to
+    retry, estimated from the recent time a slot is held and the queue ahead.
+    Time a request already spent queued upstream (see `waited`) counts
+    towards its deadline, so requests that queued in front of the worker are
+    shed without being analyzed.
+    """
+
+    def __init__(self, concurrency, queue_depth, queue_timeout, smoothing=0.2, max_retry_after=60):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.smoothing = smoothing
+        self.max_retry_after = max_retry_after
+        self._lock = threading.Lock()
+        self._active = 0
+        # One event per waiting caller; a released slot is handed to the oldest directly
+        self._waiters = deque()
+        self._service_time = None
+
+    def _retry_after(self):
+        # Seconds until a slot is likely free for a new caller; caller holds the lock
+        service_time = self._service_time or 1.0
+        ahead = len(self._waiters) + 1
+        return max(1, min(self.max_retry_after, math.ceil(service_time * ahead / max(self.concurrency, 1))))
+
+    def check(self, waited=0.0):
+        """Turn a request away before any work is done on it if it could not be admitted"""
+        with self._lock:
+            if waited >= self.queue_timeout:
+                raise Overloaded(503, 'timeout', self._retry_after())
+            if self._active >= self.concurrency and len(self._waiters) >= self.queue_depth:
+                raise Overloaded(429, 'queue_full', self._retry_after())
+
+    def acquire(self, waited=0.0):
+        """Take a slot, waiting for one in turn; release() it when done"""
+        with self._lock:
+            if self._active < self.concurrency and not self._waiters:
+                self._active += 1
+                return
+            if len(self._waiters) >= self.queue_depth:
+                raise Overloaded(429, 'queue_full', self._retry_after())
+            turn = threading.Event()
+            self._waiters.append(turn)
+
+        if not turn.wait(max(0.0, self.queue_timeout - waited)):
+            with self._lock:
+                # The slot may have been handed over just as the wait ran out
+                if not turn.is_set():
+                    self._waiters.remove(turn)
+                    raise Overloaded(503, 'timeout', self._retry_after())
+
+    def release(self, held):
+        """Give the slot back after holding it for `held` seconds"""
+        with self._lock:
+            alpha = self.smoothing if self._service_time is not None else 1.0
+            self._service_time = (1 - alpha) * (self._service_time or 0.0) + alpha * held
+            if self._waiters:
+                # The slot passes straight to the oldest waiter, so _active stays the same
+                self._waiters.popleft().set()
+            else:
+                self._active -= 1
+
+
+def upstream_wait(value, now=None):
+    """Seconds since a request-start header value (X-Request-Start style), or 0.0 if unparseable.
+
+    Accepts `t=<time>` or a bare number, in seconds, milliseconds or
+    microseconds since the epoch, as the common proxies write it.
+    """
+    if not value:
+        return 0.0
+    try:
+        started = float(value.strip().removeprefix('t='))
+    except ValueError:
+        return 0.0
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(0.0, (now or time.time()) - started)
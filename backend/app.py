@@ -1,459 +1,337 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import (Flask, Request, Response, g, has_request_context, request, jsonify, render_template_string,
+                   url_for)
 from flask_cors import CORS
+from werkzeug.exceptions import BadRequest, HTTPException
+import PIL.Image
 import os
 import base64
-import random
+import hashlib
+import hmac
+import json
+import zlib
 from datetime import datetime
-from PIL import Image
 import io
-import cv2
-import numpy as np
+import math
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import random
+import secrets
+import sys
+import tempfile
+
+# `python backend/app.py` puts backend/ rather than the repo root on sys.path
+if __package__ in (None, ''):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# OpenCV and numpy (backend.features, backend.gallery, the hashing functions) are imported
+# on first use, so a worker serving only the catalogue routes never loads them;
+# load_image_stack() imports them up front
+from backend.admission import AdmissionController, Overloaded, upstream_wait
+from backend.assets import AssetManifest
+from backend.cache import ResultCache, SharedCache
+from backend.ingest import SniffingUpload
+from backend.jobs import JobQueue
+from backend.keywords import KeywordMatcher
+from backend.phash import NearDuplicateIndex
+from backend.profiler import ProfileStore, StackSampler, collapsed, sample_call, speedscope
+from backend.organ_store import FIELDS, SUMMARY_FIELDS, TEXT_FIELDS, open_store
+from backend.metrics import (BYTES_BUCKETS, LATENCY_BUCKETS, MEGAPIXEL_BUCKETS, Metrics, collect_stages,
+                             record_stages, server_timing, stage, stage_listener, stage_timings,
+                             start_stage_timings, stop_stage_timings)
+from backend.payloads import Payload
+from backend.scan_stream import ScanSessions
+from backend.search import SearchIndex
 
 app = Flask(__name__)
 CORS(app)
 
-# Comprehensive organ data with detailed descriptions and 3D model parameters
-ORGANS_DATA = {
-    'heart': {
-        'name': 'Heart',
-        'emoji': '❤️',
-        'model_id': 'heart',
-        'description': 'The powerful muscular organ that pumps blood throughout your circulatory system.',
-        'color': '#DC2626',
-        'system': 'Cardiovascular System',
-        'animation': 'beat',
-        'sketchfab_url': 'https://skfb.ly/6y9Uq',
-        'full_description': '''
-            ANATOMICAL OVERVIEW:
-            The human heart is a sophisticated four-chambered muscular pump located in the mediastinum of the thoracic cavity,
-            slightly left of center behind the sternum. Roughly the size of a closed fist (12 cm long, 8 cm wide, 6 cm thick),
-            it weighs approximately 250-300 grams in females and 300-350 grams in males.
-
-            STRUCTURAL COMPONENTS:
-            • Pericardium: Double-walled sac containing serous fluid that protects and lubricates the heart
-            • Myocardium: Thick muscular middle layer responsible for contraction
-            • Endocardium: Smooth inner lining that minimizes friction for blood flow
-            • Chambers: Four chambers (2 atria, 2 ventricles) separated by valves
-            • Valves: Four one-way valves ensuring unidirectional blood flow
-
-            FUNCTIONAL PHYSIOLOGY:
-            The heart functions as a dual pump system - the right side handles pulmonary circulation (lungs) while the left side
-            manages systemic circulation (body). Each cardiac cycle involves coordinated atrial and ventricular contractions
-            (systole) and relaxations (diastole), maintaining a continuous blood flow of approximately 5-6 liters per minute at rest.
-
-            BLOOD FLOW PATHWAY:
-            Body → Superior/Inferior Vena Cava → Right Atrium → Tricuspid Valve → Right Ventricle → Pulmonary Valve →
-            Pulmonary Arteries → Lungs → Pulmonary Veins → Left Atrium → Mitral Valve → Left Ventricle → Aortic Valve → Aorta → Body
-
-            CLINICAL SIGNIFICANCE:
-            Understanding cardiac anatomy is crucial for diagnosing and treating conditions like coronary artery disease,
-            valvular disorders, arrhythmias, and congenital heart defects. The heart's electrical conduction system,
-            beginning at the sinoatrial (SA) node, ensures coordinated contractions for efficient pumping.
-        ''',
-    },
-    'lungs': {
-        'name': 'Lungs',
-        'emoji': '🫁',
-        'model_id': 'lungs',
-        'description': 'Paired respiratory organs for gas exchange.',
-        'color': '#059669',
-        'system': 'Respiratory System',
-        'animation': 'breathe',
-        'sketchfab_url': 'https://skfb.ly/69zrM',
-        'full_description': '''
-            GROSS PULMONARY ANATOMY:
-            The lungs are paired, cone-shaped respiratory organs occupying most of the thoracic cavity. They extend
-            from the diaphragm inferiorly to slightly above the clavicles superiorly, and are separated by the
-            mediastinum containing the heart and great vessels.
-
-            STRUCTURAL CHARACTERISTICS:
-            • Right Lung: Three lobes (superior, middle, inferior) separated by oblique and horizontal fissures
-            • Left Lung: Two lobes (superior, inferior) separated by oblique fissure, with cardiac notch
-            • Weight: Right lung ~625g, left lung ~565g (males slightly heavier than females)
-
-            BRONCHOPULMONARY SEGMENTS:
-            Each lung is divided into functionally independent segments, each supplied by:
-            • Segmental Bronchus
-            • Segmental Artery
-            • Segmental Vein (intersegmental)
-            There are 10 segments in the right lung and 8-10 in the left lung.
-
-            HISTOLOGICAL ORGANIZATION:
-            The lungs feature a branching architecture with 23 generations from trachea to alveoli:
-            • Conducting Zone: Generations 0-16 (trachea to terminal bronchioles)
-            • Respiratory Zone: Generations 17-23 (respiratory bronchioles to alveolar sacs)
-        ''',
-    },
-    'digestive': {
-        'name': 'Digestive System',
-        'emoji': '🍽️',
-        'model_id': 'digestive',
-        'description': 'Complex system for food processing, nutrient absorption, and waste elimination.',
-        'color': '#D97706',
-        'system': 'Digestive System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/6Rqz8',
-        'full_description': '''
-            GASTROINTESTINAL OVERVIEW:
-            The human digestive system is a continuous muscular tube extending from mouth to anus, approximately
-            9 meters (30 feet) in length, with accessory organs that contribute to the digestive process.
-
-            MAJOR COMPONENTS:
-            • Upper GI Tract: Mouth, pharynx, esophagus, stomach
-            • Lower GI Tract: Small intestine, large intestine, rectum, anus
-            • Accessory Organs: Liver, gallbladder, pancreas
-
-            FUNCTIONAL PROCESSES:
-            • Ingestion: Food intake through mouth
-            • Digestion: Mechanical and chemical breakdown of food
-            • Absorption: Nutrient transfer to bloodstream
-            • Motility: Movement through GI tract via peristalsis
-            • Elimination: Waste removal as feces
-
-            HISTOLOGICAL ORGANIZATION:
-            Four main layers throughout most of the GI tract:
-            • Mucosa: Inner epithelial lining with glands
-            • Submucosa: Connective tissue with blood vessels and nerves
-            • Muscularis: Smooth muscle layers for peristalsis
-            • Serosa/Adventitia: Outer protective covering
-        ''',
-    },
-    'liver': {
-        'name': 'Liver',
-        'emoji': '🟫',
-        'model_id': 'liver',
-        'description': 'Vital metabolic organ with detoxification and storage functions.',
-        'color': '#B45309',
-        'system': 'Digestive System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/6DULo',
-        'full_description': '''
-            HEPATIC ANATOMY:
-            The liver is the largest internal organ and largest gland in the human body, weighing approximately 1.5 kg
-            in adults. It occupies the right upper quadrant of the abdominal cavity, beneath the diaphragm.
-
-            FUNCTIONAL UNITS:
-            • Hepatocytes: Main functional cells performing metabolic functions
-            • Lobules: Hexagonal structural units with central veins
-            • Portal Triads: Branches of hepatic artery, portal vein, and bile duct
-            • Sinusoids: Vascular channels allowing blood-hepatocyte interaction
-
-            MAJOR FUNCTIONS:
-            • Metabolism: Carbohydrate, lipid, and protein metabolism
-            • Detoxification: Processing of drugs, alcohol, and metabolic waste
-            • Bile Production: Essential for fat digestion and absorption
-            • Storage: Glycogen, vitamins, and minerals storage
-            • Synthesis: Plasma proteins, clotting factors, and cholesterol
-
-            CLINICAL SIGNIFICANCE:
-            Liver function tests assess hepatic health, while conditions like cirrhosis, hepatitis, and fatty liver
-            disease highlight the organ's vulnerability to various insults.
-        ''',
-    },
-    'brain': {
-        'name': 'Brain',
-        'emoji': '🧠',
-        'model_id': 'brain',
-        'description': 'The control center of your nervous system and consciousness.',
-        'color': '#7C3AED',
-        'system': 'Central Nervous System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/6QYCE',
-        'full_description': '''
-            GROSS NEUROANATOMY:
-            The human brain is the most complex biological structure known, weighing approximately 1.4 kg (3 lbs)
-            and containing an estimated 86 billion neurons and similar number of glial cells. It consumes 20-25% of
-            the body's oxygen and glucose despite representing only 2% of body weight.
-
-            MAJOR DIVISIONS:
-            • Cerebrum (Telencephalon): Largest part for higher cognitive functions
-            • Diencephalon: Thalamus and hypothalamus for relay and regulation
-            • Brainstem: Midbrain, pons, medulla for basic life functions
-            • Cerebellum: Coordination and motor learning
-            • Limbic System: Emotional processing and memory
-
-            PROTECTIVE STRUCTURES:
-            • Skull: Bony cranial vault providing mechanical protection
-            • Meninges: Three protective membranes (dura mater, arachnoid, pia mater)
-            • Cerebrospinal Fluid: Buoyant cushion in ventricular system and subarachnoid space
-            • Blood-Brain Barrier: Selective permeability maintaining stable environment
-
-            FUNCTIONAL ORGANIZATION:
-            The brain exhibits both localization (specific functions in specific areas) and distribution
-            (networks collaborating across regions). The cerebral cortex, with its characteristic gyri and sulci,
-            provides approximately 2,500 cm² of surface area within the confined cranial space.
-
-            BLOOD SUPPLY:
-            The brain receives 15-20% of cardiac output through two paired systems:
-            • Internal Carotid Arteries: Anterior and middle cerebral circulation
-            • Vertebral Arteries: Posterior circulation joining to form basilar artery
-            The Circle of Willis provides collateral circulation at the base of the brain.
-        ''',
-    },
-    'nervous_system': {
-        'name': 'Nervous System',
-        'emoji': '🧬',
-        'model_id': 'nervous_system',
-        'description': 'Complex network of nerves and cells that transmit signals throughout the body.',
-        'color': '#8B5CF6',
-        'system': 'Nervous System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/oF6DV',
-        'full_description': '''
-            NEUROLOGICAL OVERVIEW:
-            The human nervous system is an extraordinarily complex network of specialized cells that coordinates
-            voluntary and involuntary actions, transmits sensory information, and processes cognitive functions.
-            It consists of billions of neurons and supporting glial cells.
-
-            MAJOR DIVISIONS:
-            • Central Nervous System (CNS): Brain and spinal cord
-            • Peripheral Nervous System (PNS): All neural tissue outside CNS
-
-            PERIPHERAL NERVOUS SYSTEM SUBSYSTEMS:
-            • Somatic Nervous System: Voluntary control of skeletal muscles
-            • Autonomic Nervous System: Involuntary control of smooth muscles, cardiac muscle, and glands
-            • Enteric Nervous System: Semi-independent system governing gastrointestinal function
-
-            AUTONOMIC NERVOUS SYSTEM DIVISIONS:
-            • Sympathetic Division: "Fight or flight" responses
-            • Parasympathetic Division: "Rest and digest" functions
-            • Enteric Division: Independent gut nervous system
-
-            NEURONAL ORGANIZATION:
-            • Sensory Neurons: Afferent pathways carrying information to CNS
-            • Motor Neurons: Efferent pathways carrying commands from CNS
-            • Interneurons: Association neurons within CNS for processing
-        ''',
-    },
-    'full_body': {
-        'name': 'Complete Human Body',
-        'emoji': '👤',
-        'model_id': 'full_body',
-        'description': 'Comprehensive anatomical representation of the entire human body.',
-        'color': '#6366F1',
-        'system': 'Multiple Systems',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/oKs8T',
-        'full_description': '''
-            COMPREHENSIVE ANATOMICAL OVERVIEW:
-            The human body represents one of the most complex biological systems known, comprising multiple
-            integrated systems working in harmony to maintain homeostasis and enable sophisticated functions
-            from cellular metabolism to conscious thought and coordinated movement.
-
-            MAJOR ORGAN SYSTEMS:
-            • Integumentary System: Skin, hair, nails - external protection
-            • Skeletal System: Bones, joints - structure and support
-            • Muscular System: Skeletal, cardiac, smooth muscles - movement
-            • Nervous System: Brain, spinal cord, nerves - control and coordination
-            • Endocrine System: Glands and hormones - chemical regulation
-            • Cardiovascular System: Heart and blood vessels - circulation
-            • Lymphatic System: Lymph nodes and vessels - immunity and fluid balance
-            • Respiratory System: Lungs and airways - gas exchange
-            • Digestive System: GI tract and accessory organs - nutrient processing
-            • Urinary System: Kidneys and bladder - waste elimination
-            • Reproductive System: Gonads and reproductive structures - reproduction
-
-            SYSTEMIC INTEGRATION:
-            All body systems work in coordinated harmony through:
-            • Neural Regulation: Fast-acting nervous system control
-            • Endocrine Regulation: Slower, sustained hormonal control
-            • Local Regulation: Tissue-level autocrine and paracrine signaling
-            • Homeostatic Mechanisms: Feedback loops maintaining internal stability
-
-            DEVELOPMENTAL ANATOMY:
-            The human body develops through precisely timed stages from fertilization through adulthood,
-            with different systems maturing at different rates while maintaining functional integration.
-        ''',
-    },
-    'skull': {
-        'name': 'Skull',
-        'emoji': '💀',
-        'model_id': 'skull',
-        'description': 'Bony structure that forms the head and protects the brain.',
-        'color': '#6B7280',
-        'system': 'Skeletal System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/oDHF6',
-        'full_description': '''
-            OSTEOLOGICAL OVERVIEW:
-            The human skull is a complex bony structure composed of 22 bones (excluding the ossicles of the middle ear)
-            that form the protective cranial vault for the brain and the framework for the face.
-
-            MAJOR DIVISIONS:
-            • Neurocranium: Protective vault surrounding the brain (8 bones)
-            • Viscerocranium: Facial skeleton (14 bones)
-            • Mandible: Lower jaw bone (considered separately)
-
-            CRANIAL BONES:
-            • Frontal Bone: Forehead and superior orbit
-            • Parietal Bones (2): Superior and lateral cranium
-            • Temporal Bones (2): Lateral base and middle ear housing
-            • Occipital Bone: Posterior base with foramen magnum
-            • Sphenoid Bone: Keystone bone articulating with all cranial bones
-            • Ethmoid Bone: Anterior cranial floor, nasal cavity, and orbit
-
-            CLINICAL SIGNIFICANCE:
-            The skull provides crucial protection for the brain while allowing passage for nerves and blood vessels
-            through various foramina. Understanding skull anatomy is essential for neurosurgery, trauma management,
-            and anthropological studies.
-        ''',
-    },
-    'eye': {
-        'name': 'Eye',
-        'emoji': '👁️',
-        'model_id': 'eye',
-        'description': 'Sensory organ of vision that detects light and converts it into neural signals.',
-        'color': '#0EA5E9',
-        'system': 'Sensory System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/onqUK',
-        'full_description': '''
-            OCULAR ANATOMY:
-            The human eye is a complex sensory organ approximately 2.5 cm in diameter that converts light into
-            electrochemical impulses interpreted by the brain as vision.
-
-            MAJOR STRUCTURES:
-            • Cornea: Transparent anterior covering that refracts light
-            • Iris: Colored diaphragm controlling pupil size
-            • Lens: Flexible structure that focuses light onto retina
-            • Retina: Light-sensitive layer containing photoreceptors
-            • Optic Nerve: Transmits visual information to brain
-
-            PHOTORECEPTORS:
-            • Rods: 120 million cells for low-light vision and motion detection
-            • Cones: 6-7 million cells for color vision and fine detail
-            • Distribution: Concentrated in macula and fovea centralis
-
-            VISUAL PATHWAY:
-            Light → Cornea → Aqueous Humor → Pupil → Lens → Vitreous Humor → Retina → Optic Nerve → Brain
-
-            CLINICAL CORRELATIONS:
-            Common visual disorders include myopia, hyperopia, astigmatism, cataracts, glaucoma, and macular degeneration.
-            Regular eye examinations are crucial for maintaining visual health.
-        ''',
-    },
-    'teeth': {
-        'name': 'Teeth',
-        'emoji': '🦷',
-        'model_id': 'teeth',
-        'description': 'Hard, calcified structures used for biting and chewing food.',
-        'color': '#F0FDF4',
-        'system': 'Digestive System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/oQuZS',
-        'full_description': '''
-            DENTAL ANATOMY:
-            Human teeth are specialized calcified structures embedded in the mandible and maxilla, designed for
-            mechanical digestion through cutting, tearing, and grinding food.
-
-            TOOTH TYPES AND FUNCTIONS:
-            • Incisors (8): Chisel-shaped for cutting food
-            • Canines (4): Pointed for tearing food
-            • Premolars (8): For crushing and grinding
-            • Molars (12): Large surfaces for thorough grinding
-
-            TOOTH STRUCTURE:
-            • Crown: Visible portion above gum line
-            • Root: Embedded in alveolar bone
-            • Enamel: Hardest substance in human body covering crown
-            • Dentin: Bulk of tooth beneath enamel
-            • Pulp: Soft tissue containing nerves and blood vessels
-            • Cementum: Covers root surface
-
-            DENTITION DEVELOPMENT:
-            • Primary Dentition: 20 deciduous teeth erupting 6 months - 3 years
-            • Mixed Dentition: 6-12 years with both primary and permanent teeth
-            • Permanent Dentition: 32 teeth completing by early adulthood
-
-            CLINICAL SIGNIFICANCE:
-            Dental health affects overall systemic health. Conditions like caries, periodontal disease, and
-            malocclusion require professional dental care for prevention and treatment.
-        ''',
-    },
-    'ovary': {
-        'name': 'Ovary',
-        'emoji': '🥚',
-        'model_id': 'ovary',
-        'description': 'Female reproductive organ producing ova and hormones.',
-        'color': '#EC4899',
-        'system': 'Reproductive System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/oGrRn',
-        'full_description': '''
-            REPRODUCTIVE ANATOMY:
-            The ovaries are paired almond-shaped organs measuring 3-5 cm in length, located in the lateral pelvic wall.
-            They serve dual functions of gamete production and endocrine secretion.
-
-            STRUCTURAL ORGANIZATION:
-            • Germinal Epithelium: Outer covering of ovary
-            • Cortex: Contains ovarian follicles in various stages of development
-            • Medulla: Central region with blood vessels, nerves, and connective tissue
-            • Follicles: Structures containing developing oocytes
-
-            FOLLICULAR DEVELOPMENT:
-            • Primordial Follicles: 400,000-500,000 at birth, dormant until puberty
-            • Primary Follicles: Begin maturation in response to FSH
-            • Secondary Follicles: Develop fluid-filled antrum
-            • Graafian Follicle: Mature follicle ready for ovulation
-            • Corpus Luteum: Forms after ovulation, secretes progesterone
-
-            ENDOCRINE FUNCTIONS:
-            • Estrogen: Development of female secondary sexual characteristics
-            • Progesterone: Prepares endometrium for implantation
-            • Inhibin: Regulates FSH secretion
-
-            REPRODUCTIVE CYCLE:
-            The ovarian cycle consists of follicular phase (days 1-14) and luteal phase (days 15-28),
-            coordinated with the uterine menstrual cycle through complex hormonal feedback mechanisms.
-        ''',
-    },
-    'male_reproductive': {
-        'name': 'Male Reproductive System',
-        'emoji': '👨',
-        'model_id': 'male_reproductive',
-        'description': 'Organs responsible for sperm production and delivery.',
-        'color': '#3B82F6',
-        'system': 'Reproductive System',
-        'animation': 'pulse',
-        'sketchfab_url': 'https://skfb.ly/oOIoL',
-        'full_description': '''
-            MALE REPRODUCTIVE ANATOMY:
-            The male reproductive system consists of both internal and external organs dedicated to sperm production,
-            maturation, storage, and delivery, along with hormone secretion.
-
-            EXTERNAL ORGANS:
-            • Penis: Organ for sexual intercourse and urination
-            • Scrotum: Skin sac containing testes, maintaining optimal temperature
-
-            INTERNAL ORGANS:
-            • Testes: Paired organs producing sperm and testosterone
-            • Epididymis: Coiled tube for sperm maturation and storage
-            • Vas Deferens: Muscular tube transporting sperm
-            • Seminal Vesicles: Produce seminal fluid
-            • Prostate Gland: Adds alkaline fluid to semen
-            • Bulbourethral Glands: Produce pre-ejaculate fluid
-
-            SPERMATOGENESIS:
-            • Location: Seminiferous tubules of testes
-            • Duration: Approximately 74 days for complete cycle
-            • Process: Spermatogonia → Primary Spermatocytes → Secondary Spermatocytes → Spermatids → Spermatozoa
-            • Daily Production: 100-200 million sperm
-
-            HORMONAL REGULATION:
-            • Testosterone: Development of male characteristics, libido, sperm production
-            • FSH: Stimulates spermatogenesis
-            • LH: Stimulates testosterone production
-            • Inhibin: Negative feedback on FSH secretion
-
-            CLINICAL CONSIDERATIONS:
-            Common conditions include infertility, benign prostatic hyperplasia, prostate cancer, and erectile dysfunction.
-            Regular urological examinations are recommended for maintaining reproductive health.
-        ''',
-    }
-}
+# Longest side (in pixels) uploads are decoded to before analysis; 0 analyzes at full resolution
+ANALYSIS_MAX_SIDE = int(os.environ.get('ANALYSIS_MAX_SIDE', 512))
+
+# Image heuristics used by smart_detect_organ. Edge density is expressed at the
+# source resolution so the threshold holds whatever scale the image was analyzed at.
+EDGE_DENSITY_THRESHOLD = 0.15
+BRIGHTNESS_RANGE = (80, 180)
+
+# Process pool for CPU-bound image analysis (/api/upload/batch, and /api/upload when
+# ANALYSIS_OFFLOAD is set); defaults to one single-threaded process per core
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', os.cpu_count() or 1))
+ANALYSIS_OFFLOAD = os.environ.get('ANALYSIS_OFFLOAD', '').lower() in ('1', 'true', 'yes')
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 64))
+# Batch files are all held in memory until analyzed, so a whole batch body is capped too
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 100 * 1024 * 1024))
+
+# Admission control for /api/upload analyses, per worker: ADMISSION_CONCURRENCY run at once,
+# up to ADMISSION_QUEUE_DEPTH more wait at most ADMISSION_QUEUE_TIMEOUT seconds, and the rest
+# are answered 429/503 with Retry-After at once. ADMISSION_CONCURRENCY=0 turns it off. Behind a
+# proxy that stamps requests (e.g. X-Request-Start), naming the header in
+# ADMISSION_REQUEST_START_HEADER counts the time spent queued in front of the worker too.
+# A sync worker serves one request at a time, so its queue never fills: there the header is
+# the only thing that sheds (see gunicorn.conf.py). Cached results are served regardless.
+ADMISSION_CONCURRENCY = int(os.environ.get('ADMISSION_CONCURRENCY', ANALYSIS_WORKERS if ANALYSIS_OFFLOAD else 1))
+ADMISSION_QUEUE_DEPTH = int(os.environ.get('ADMISSION_QUEUE_DEPTH', 2 * ADMISSION_CONCURRENCY))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5.0))
+ADMISSION_REQUEST_START_HEADER = os.environ.get('ADMISSION_REQUEST_START_HEADER', '')
+
+# Background analysis jobs (/api/jobs): JOBS_WORKERS threads per worker run them, taking
+# their turn with /api/upload under admission control. At most JOBS_MAX_PENDING wait or run
+# at once, holding at most JOBS_MAX_PENDING_BYTES of uploads in memory between them, and
+# results are kept JOBS_RESULT_TTL seconds after they finish
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', ADMISSION_CONCURRENCY or 1))
+JOBS_MAX_PENDING = int(os.environ.get('JOBS_MAX_PENDING', 32))
+JOBS_MAX_PENDING_BYTES = int(os.environ.get('JOBS_MAX_PENDING_BYTES', 64 * 1024 * 1024))
+JOBS_RESULT_TTL = int(os.environ.get('JOBS_RESULT_TTL', 600))
+# Seconds between keep-alive comments on a quiet event stream
+JOBS_HEARTBEAT = 15
+
+# Request profiling (backend/profiler.py), off unless one of the first two is set: a
+# PROFILE_SAMPLE_RATE share of API requests is profiled, and so is any request slower than
+# PROFILE_SLOW_SECONDS. Stacks are sampled every PROFILE_INTERVAL seconds; the newest
+# PROFILE_MAX_CAPTURES profiles are kept in PROFILE_DIR (gunicorn.conf.py shares one
+# between workers) and listed by /api/admin/profiles to requests bearing PROFILE_ADMIN_TOKEN
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_MAX_CAPTURES = int(os.environ.get('PROFILE_MAX_CAPTURES', 50))
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN', '')
+
+# OpenCV threads for analysis run inside the serving process (gunicorn.conf.py divides the cores
+# between workers). OpenCV reads OPENCV_FOR_THREADS_NUM when it is first imported.
+if os.environ.get('CV_NUM_THREADS'):
+    os.environ['OPENCV_FOR_THREADS_NUM'] = os.environ['CV_NUM_THREADS']
+    if 'cv2' in sys.modules:
+        sys.modules['cv2'].setNumThreads(int(os.environ['CV_NUM_THREADS']))
+
+# Reference gallery (see backend/gallery.py) consulted when the filename gives no answer
+GALLERY_DIR = os.environ.get('GALLERY_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gallery'))
+GALLERY_K = int(os.environ.get('GALLERY_K', 5))
+# Share of the neighbours' weighted vote the winning organ needs before it is trusted
+GALLERY_MIN_SHARE = float(os.environ.get('GALLERY_MIN_SHARE', 0.6))
+
+# Upload results keyed by content hash; 0 entries disables caching
+UPLOAD_CACHE_SIZE = int(os.environ.get('UPLOAD_CACHE_SIZE', 1024))
+UPLOAD_CACHE_TTL = int(os.environ.get('UPLOAD_CACHE_TTL', 3600))
+
+# Second cache tier on the host, shared by all workers and kept across restarts, for upload
+# results and organ payloads; gunicorn.conf.py sets up a directory only this service can write
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR')
+SHARED_CACHE_MAX_BYTES = int(os.environ.get('SHARED_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Perceptual-hash index of analyzed images: resized or recompressed copies within
+# NEAR_DUPLICATE_DISTANCE bits reuse the stored edge features; 0 entries disables it
+NEAR_DUPLICATE_SIZE = int(os.environ.get('NEAR_DUPLICATE_SIZE', 4096))
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_DISTANCE', 6))
+
+# Clients may reuse organ catalogue responses this long before revalidating their ETag
+ORGANS_CACHE_MAX_AGE = int(os.environ.get('ORGANS_CACHE_MAX_AGE', 300))
+# Organ catalogue source and the SQLite file compiled from it (rebuilt when older than the source)
+ORGAN_SOURCE_PATH = os.environ.get('ORGAN_SOURCE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'organs.json'))
+ORGAN_STORE_PATH = os.environ.get('ORGAN_STORE_PATH', os.path.splitext(ORGAN_SOURCE_PATH)[0] + '.sqlite3')
+# Catalogue responses (per organ and per field projection) kept serialized and compressed
+ORGAN_PAYLOAD_CACHE_SIZE = int(os.environ.get('ORGAN_PAYLOAD_CACHE_SIZE', 256))
+
+# Scripts and stylesheets served fingerprinted under /assets/ (see backend/assets.py)
+FRONTEND_DIR = os.environ.get('FRONTEND_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend'))
+
+# /api/search ranking: a term found in an organ's name counts three times one in its long description
+SEARCH_FIELD_WEIGHTS = {'name': 3.0, 'system': 2.0, 'keywords': 2.0, 'description': 1.5, 'full_description': 1.0}
+SEARCH_MAX_RESULTS = 50
+
+# Per-image upload limits, enforced while the multipart body streams in
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 25 * 1024 * 1024))
+UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', 100_000_000))
+# Uncompressed TIFF pages are analyzed in place without being decoded (backend/tiled.py),
+# so they get a higher pixel limit; the byte limit still applies
+TILED_MAX_PIXELS = int(os.environ.get('TILED_MAX_PIXELS', 1_000_000_000))
+# PIL refuses to open anything over twice its MAX_IMAGE_PIXELS; the limits above are checked
+# explicitly, so its guard only needs to stop headers claiming far more than either
+PIL.Image.MAX_IMAGE_PIXELS = max(UPLOAD_MAX_PIXELS, TILED_MAX_PIXELS) or None
+# Allowance for multipart boundaries, part headers and form fields in the request body
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Multi-page TIFFs and 16-bit images are analyzed page by page and tile by tile, as are uncompressed
+# TIFFs over TILED_MIN_PIXELS; at most TILED_MAX_PAGES pages of a scan are read
+TILED_MIN_PIXELS = int(os.environ.get('TILED_MIN_PIXELS', 16_000_000))
+TILED_MAX_PAGES = int(os.environ.get('TILED_MAX_PAGES', 64))
+
+# Live camera scans (/api/scan/...): a frame is analyzed only when its 32x32 thumbnail
+# differs from the last analyzed frame by SCAN_CHANGE_THRESHOLD grey levels on average,
+# and at most once per SCAN_MIN_INTERVAL seconds. Results are smoothed with weight
+# SCAN_SMOOTHING on the newest analysis.
+SCAN_CHANGE_THRESHOLD = float(os.environ.get('SCAN_CHANGE_THRESHOLD', 6.0))
+SCAN_MIN_INTERVAL = float(os.environ.get('SCAN_MIN_INTERVAL', 0.2))
+SCAN_SMOOTHING = float(os.environ.get('SCAN_SMOOTHING', 0.4))
+SCAN_SESSION_TTL = int(os.environ.get('SCAN_SESSION_TTL', 300))
+# Frames are low-resolution captures, so they get a much smaller size limit than uploads
+SCAN_FRAME_MAX_BYTES = int(os.environ.get('SCAN_FRAME_MAX_BYTES', 2 * 1024 * 1024))
+
+class UploadRequest(Request):
+    """Request that buffers uploaded files in memory, vetting each image header as it arrives"""
+
+    @property
+    def upload_max_bytes(self):
+        return SCAN_FRAME_MAX_BYTES if self.endpoint == 'scan_frame' else UPLOAD_MAX_BYTES
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'upload_batch':
+            return min(BATCH_MAX_FILES * (self.upload_max_bytes + MULTIPART_OVERHEAD),
+                       BATCH_MAX_BYTES + MULTIPART_OVERHEAD)
+        return self.upload_max_bytes + MULTIPART_OVERHEAD
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # A batch reports a rejected file in its results instead of failing the whole request
+        return SniffingUpload(self.upload_max_bytes, UPLOAD_MAX_PIXELS, max_mapped_pixels=TILED_MAX_PIXELS,
+                              strict=self.endpoint != 'upload_batch')
+
+app.request_class = UploadRequest
+
+# Request metrics for /api/metrics; a METRICS_DIR shared by all workers (set up by
+# gunicorn.conf.py) lets any worker report totals for the whole server
+metrics = Metrics('scanspectrum', directory=os.environ.get('METRICS_DIR'))
+metrics.declare('requests_total', 'counter', 'API requests by route, method and status.')
+metrics.declare('request_errors_total', 'counter', 'API responses with a 4xx or 5xx status.')
+metrics.declare('requests_in_flight', 'gauge', 'API requests currently being handled.')
+metrics.declare('request_duration_seconds', 'histogram', 'API request latency.', LATENCY_BUCKETS)
+metrics.declare('stage_duration_seconds', 'histogram', 'Upload pipeline stage latency.', LATENCY_BUCKETS)
+metrics.declare('upload_bytes', 'histogram', 'Size of uploaded image files.', BYTES_BUCKETS)
+metrics.declare('upload_megapixels', 'histogram', 'Dimensions of uploaded images.', MEGAPIXEL_BUCKETS)
+metrics.declare('admission_rejected_total', 'counter', 'Uploads turned away by admission control, by reason.')
+metrics.declare('profiles_captured_total', 'counter', 'Request profiles kept, by reason.')
+
+def record_upload_size(file, data):
+    metrics.observe('upload_bytes', len(data))
+    info = getattr(file.stream, 'info', None)
+    if info:
+        width, height = info['size']
+        metrics.observe('upload_megapixels', width * height / 1e6)
+        g.upload_dimensions = (width, height)
+
+@app.before_request
+def start_request_metrics():
+    if not request.path.startswith('/api/'):
+        return
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_start = time.perf_counter()
+    g.metrics_token = start_stage_timings()
+    metrics.gauge_add('requests_in_flight', 1, route=g.metrics_route)
+
+@app.after_request
+def finish_request_metrics(response):
+    if 'metrics_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.metrics_start
+    route, timings = g.metrics_route, stage_timings()
+    response.headers['Server-Timing'] = server_timing(timings, elapsed)
+
+    status = str(response.status_code)
+    metrics.inc('requests_total', route=route, method=request.method, status=status)
+    if response.status_code >= 400:
+        metrics.inc('request_errors_total', route=route, status=status)
+    metrics.observe('request_duration_seconds', elapsed, route=route)
+    for name, seconds in timings.items():
+        metrics.observe('stage_duration_seconds', seconds, route=route, stage=name)
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    if 'metrics_token' in g:
+        metrics.gauge_add('requests_in_flight', -1, route=g.metrics_route)
+        stop_stage_timings(g.metrics_token)
+
+profiler = StackSampler(PROFILE_INTERVAL) if PROFILE_SAMPLE_RATE or PROFILE_SLOW_SECONDS else None
+profile_store = None
+if profiler is not None:
+    profile_store = ProfileStore(PROFILE_DIR or tempfile.mkdtemp(prefix='scanspectrum-profiles-'),
+                                 max_captures=PROFILE_MAX_CAPTURES)
+
+@app.before_request
+def start_profile():
+    # Unprofiled requests are never registered with the sampler, so they cost one comparison
+    if profiler is None or not request.path.startswith('/api/') or request.path.startswith('/api/admin/'):
+        return
+    g.profile_sampled = random.random() < PROFILE_SAMPLE_RATE
+    if g.profile_sampled or PROFILE_SLOW_SECONDS:
+        g.profile = profiler.record()
+
+@app.after_request
+def keep_profile(response):
+    recording = g.pop('profile', None)
+    if recording is None:
+        return response
+    profiler.stop(recording)
+    elapsed = time.perf_counter() - recording.started
+    slow = PROFILE_SLOW_SECONDS and elapsed >= PROFILE_SLOW_SECONDS
+    if not (slow or g.profile_sampled) or not recording.stacks:
+        return response
+    reason = 'slow' if slow else 'sampled'
+    dimensions = g.get('upload_dimensions')
+    profile_store.save({
+        'reason': reason,
+        'method': request.method,
+        'route': request.url_rule.rule if request.url_rule else 'unmatched',
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': elapsed * 1e3,
+        'stages_ms': {name: seconds * 1e3 for name, seconds in stage_timings().items()},
+        'image': {'width': dimensions[0], 'height': dimensions[1]} if dimensions else None,
+        'pid': os.getpid(),
+        'created': time.time(),
+        'interval': profiler.interval,
+        'samples': recording.samples,
+    }, dict(recording.stacks))
+    metrics.inc('profiles_captured_total', reason=reason)
+    return response
+
+@app.teardown_request
+def end_profile(exc):
+    # A request that raised skips after_request; its recording is dropped
+    recording = g.pop('profile', None)
+    if recording is not None:
+        profiler.stop(recording)
+
+# Organ catalogue (see backend/organ_store.py): edited in organs.json, served from SQLite
+organ_store = open_store(ORGAN_STORE_PATH, ORGAN_SOURCE_PATH)
+
+# Image rules applied by smart_detect_organ: (feature, predicate, score boosts)
+IMAGE_RULES = [
+    ('edge_density', lambda value: value > EDGE_DENSITY_THRESHOLD, {'skull': 0.3, 'teeth': 0.2}),
+    ('brightness', lambda value: BRIGHTNESS_RANGE[0] < value < BRIGHTNESS_RANGE[1], {'brain': 0.2}),
+]
+
+# Image features remembered for near-duplicate uploads: only those from the edge map (Canny
+# and contour tracing are the expensive part). The hash ignores absolute brightness, so
+# intensity statistics and the gallery descriptor (which holds a histogram) are always
+# computed from the upload itself, and a near-duplicate classifies exactly as it would uncached.
+NEAR_DUPLICATE_FEATURES = ['edge_density', 'contour_count']
+
+# Features reported by analyze_image_content
+IMAGE_FEATURE_SUMMARY = ['aspect_ratio', 'brightness', 'contrast', 'edge_density', 'contour_count', 'scale']
+
+# Score added to an organ for each of its keywords found in the filename
+KEYWORD_TIER_WEIGHTS = {'strong': 0.5, 'medium': 0.3, 'weak': 0.1}
+
+# Filename rules tried in order when keyword scoring is inconclusive
+FALLBACK_RULES = [
+    (('chest', 'xray', 'thorax'), 'lungs'),
+    (('head', 'brain', 'skull'), 'brain'),
+    (('cardio', 'heart'), 'heart'),
+    (('bone', 'skeleton'), 'skull'),
+    (('eye', 'vision'), 'eye'),
+    (('teeth', 'dental'), 'teeth'),
+    (('stomach', 'digestive'), 'digestive'),
+    (('liver', 'hepatic'), 'liver'),
+    (('ovary', 'female'), 'ovary'),
+    (('male', 'testis'), 'male_reproductive'),
+]
 
 class AdvancedImageProcessor:
-    def __init__(self):
+    def __init__(self, gallery=None):
+        self.gallery = gallery
         self.organ_keywords = {
             'heart': {
                 'strong': ['heart', 'cardiac', 'cardiovascular', 'ventricle', 'atrium', 'aortic', 'mitral'],
@@ -516,106 +394,469 @@ class AdvancedImageProcessor:
                 'weak': ['man', 'fertility', 'virility']
             }
         }
+        self.compile_keywords()
+
+    def compile_keywords(self):
+        """Build the single-pass matcher over organ_keywords and FALLBACK_RULES"""
+        # keyword -> [(position, organ, weight)], position being the keyword's place in
+        # the organ/tier/keyword iteration order so scores are summed in that order
+        self.keyword_hits = {}
+        position = 0
+        for organ, keywords in self.organ_keywords.items():
+            for tier, weight in KEYWORD_TIER_WEIGHTS.items():
+                for keyword in keywords[tier]:
+                    self.keyword_hits.setdefault(keyword, []).append((position, organ, weight))
+                    position += 1
 
-    def analyze_image_content(self, image):
+        fallback_words = [word for words, _ in FALLBACK_RULES for word in words]
+        self.keyword_matcher = KeywordMatcher(list(self.keyword_hits) + fallback_words)
+
+    def analyze_image_content(self, image, source_size=None):
         """Analyze image content using computer vision techniques"""
+        from backend.features import ImageFeatures
         try:
-            img_array = np.array(image)
-            
-            if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-                img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-            
-            height, width = img_array.shape[:2]
-            
-            if len(img_array.shape) == 3:
-                gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = img_array
-            
-            brightness = np.mean(gray)
-            contrast = np.std(gray)
-            
-            edges = cv2.Canny(gray, 50, 150)
-            edge_density = np.sum(edges > 0) / (width * height)
-            
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            contour_count = len(contours)
-            
-            return {
-                'aspect_ratio': width / height,
-                'brightness': brightness,
-                'contrast': contrast,
-                'edge_density': edge_density,
-                'contour_count': contour_count,
-            }
+            features = ImageFeatures(image, source_size)
+            return {name: features[name] for name in IMAGE_FEATURE_SUMMARY}
             
         except Exception as e:
             print(f"Image analysis error: {e}")
             return None
 
-    def smart_detect_organ(self, filename, image_content=None):
+    def smart_detect_organ(self, filename, image_content=None, source_size=None, features=None):
         filename_lower = filename.lower()
         
-        scores = {organ: 0 for organ in ORGANS_DATA.keys()}
+        scores = {organ: 0 for organ in organ_store.ids}
         
         # Filename analysis
-        for organ, keywords in self.organ_keywords.items():
-            for keyword in keywords['strong']:
-                if keyword in filename_lower:
-                    scores[organ] += 0.5
-            for keyword in keywords['medium']:
-                if keyword in filename_lower:
-                    scores[organ] += 0.3
-            for keyword in keywords['weak']:
-                if keyword in filename_lower:
-                    scores[organ] += 0.1
+        with stage('score'):
+            matched = self.keyword_matcher.find(filename_lower)
+            hits = sorted(hit for keyword in matched for hit in self.keyword_hits.get(keyword, ()))
+            for _, organ, weight in hits:
+                scores[organ] += weight
         
-        # Image content analysis
-        if image_content:
-            img_analysis = self.analyze_image_content(image_content)
-            if img_analysis:
-                if img_analysis['edge_density'] > 0.15:
-                    scores['skull'] += 0.3
-                    scores['teeth'] += 0.2
-                if 80 < img_analysis['brightness'] < 180:
-                    scores['brain'] += 0.2
+        # Image content analysis, computing only the features the rules read
+        if features is None and image_content:
+            from backend.features import ImageFeatures
+            features = ImageFeatures(image_content, source_size)
+        if features is not None:
+            try:
+                with stage('analyze'):
+                    boosts = [boost for name, applies, boost in IMAGE_RULES if applies(features[name])]
+            except Exception as e:
+                print(f"Image analysis error: {e}")
+                boosts = []
+            for boost in boosts:
+                for organ, weight in boost.items():
+                    scores[organ] += weight
         
         best_organ = max(scores, key=scores.get)
         best_score = scores[best_organ]
         
         if best_score < 0.3:
-            return self.fallback_detection(filename_lower, image_content)
+            if features is not None and self.gallery is not None:
+                detected = self.gallery_detection(features)
+                if detected:
+                    return detected
+            return self.fallback_detection(filename_lower, image_content, matched)
         
         confidence = min(0.7 + (best_score * 0.5), 0.95)
         return best_organ, confidence
 
-    def fallback_detection(self, filename, image_content=None):
-        if any(word in filename for word in ['chest', 'xray', 'thorax']):
-            return 'lungs', 0.7
-        elif any(word in filename for word in ['head', 'brain', 'skull']):
-            return 'brain', 0.7
-        elif any(word in filename for word in ['cardio', 'heart']):
-            return 'heart', 0.7
-        elif any(word in filename for word in ['bone', 'skeleton']):
-            return 'skull', 0.7
-        elif any(word in filename for word in ['eye', 'vision']):
-            return 'eye', 0.7
-        elif any(word in filename for word in ['teeth', 'dental']):
-            return 'teeth', 0.7
-        elif any(word in filename for word in ['stomach', 'digestive']):
-            return 'digestive', 0.7
-        elif any(word in filename for word in ['liver', 'hepatic']):
-            return 'liver', 0.7
-        elif any(word in filename for word in ['ovary', 'female']):
-            return 'ovary', 0.7
-        elif any(word in filename for word in ['male', 'testis']):
-            return 'male_reproductive', 0.7
-        else:
-            organs = ['heart', 'brain', 'lungs', 'digestive', 'liver', 'eye']
-            return random.choice(organs), 0.6
+    def gallery_detection(self, features):
+        """Nearest-neighbour vote over the reference gallery, or None when it is not decisive"""
+        try:
+            with stage('gallery'):
+                organ, share = self.gallery.classify(features['descriptor'])
+        except Exception as e:
+            print(f"Gallery classification error: {e}")
+            return None
+        if share < GALLERY_MIN_SHARE:
+            return None
+        return organ, min(0.6 + 0.3 * share, 0.9)
+
+    def fallback_detection(self, filename, image_content=None, matched=None):
+        if matched is None:
+            matched = self.keyword_matcher.find(filename)
+        for words, organ in FALLBACK_RULES:
+            if not matched.isdisjoint(words):
+                return organ, 0.7
+        
+        # Pick from the filename so the same upload always gets the same answer
+        organs = ['heart', 'brain', 'lungs', 'digestive', 'liver', 'eye']
+        return organs[zlib.crc32(filename.encode('utf-8', 'surrogatepass')) % len(organs)], 0.6
+
+def decode_for_analysis(stream, max_side=ANALYSIS_MAX_SIDE):
+    """Decode an upload to grayscale, bounded to max_side pixels on its longest edge.
+
+    JPEGs are scaled inside the decoder (DCT scaling) so the full-resolution
+    frame is never materialized. Returns the image and the source (width, height).
+    """
+    from PIL import Image
+    image = Image.open(stream)
+    source_size = image.size
+    if UPLOAD_MAX_PIXELS and source_size[0] * source_size[1] > UPLOAD_MAX_PIXELS:
+        raise ValueError(f'Image dimensions {source_size[0]}x{source_size[1]} exceed the {UPLOAD_MAX_PIXELS} pixel limit')
+
+    if max_side:
+        image.draft('L', (max_side, max_side))
+    image = image.convert('L')
+
+    if max_side and max(image.size) > max_side:
+        image = image.reduce(math.ceil(max(image.size) / max_side))
+
+    return image, source_size
+
+def load_reference_gallery():
+    if not os.path.exists(os.path.join(GALLERY_DIR, 'vectors.npy')):
+        return None
+    from backend.gallery import ReferenceGallery
+    try:
+        gallery = ReferenceGallery.load(GALLERY_DIR, k=GALLERY_K)
+    except Exception as e:
+        print(f"Reference gallery unavailable: {e}")
+        return None
+    print(f"Loaded reference gallery: {len(gallery)} images from {GALLERY_DIR}")
+    return gallery
+
+def shared_cache(namespace, ttl):
+    if not SHARED_CACHE_DIR:
+        return None
+    return SharedCache(os.path.join(SHARED_CACHE_DIR, 'cache.sqlite3'), namespace,
+                       max_bytes=SHARED_CACHE_MAX_BYTES, ttl=ttl)
+
+def source_version():
+    """Fingerprint of the backend's code, in the namespace of every shared cache of pickled
+    objects, so values pickled by one deploy are never unpickled by another"""
+    digest = hashlib.sha256()
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(backend_dir)):
+        if name.endswith('.py'):
+            with open(os.path.join(backend_dir, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def analysis_version():
+    """Fingerprint of everything an upload result depends on, so a shared cache never serves
+    results from other code, settings, reference gallery or catalogue"""
+    digest = hashlib.sha256(source_version().encode())
+    vectors = os.path.join(GALLERY_DIR, 'vectors.npy')
+    gallery_version = os.stat(vectors).st_mtime_ns if os.path.exists(vectors) else None
+    settings = (ANALYSIS_MAX_SIDE, GALLERY_K, GALLERY_MIN_SHARE, NEAR_DUPLICATE_DISTANCE, TILED_MIN_PIXELS,
+                TILED_MAX_PAGES, gallery_version, organ_store.version)
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()[:16]
 
 # Initialize processor
-image_processor = AdvancedImageProcessor()
+image_processor = AdvancedImageProcessor(gallery=load_reference_gallery())
+upload_cache = ResultCache(max_entries=UPLOAD_CACHE_SIZE, ttl=UPLOAD_CACHE_TTL,
+                           shared=shared_cache(f'upload-{analysis_version()}', UPLOAD_CACHE_TTL))
+
+def search_documents():
+    """(organ id, {field: text}) for the search index, one organ at a time"""
+    for organ_id in organ_store.ids:
+        record = organ_store.get(organ_id, ('name', 'system', 'description', 'full_description'))
+        keywords = image_processor.organ_keywords.get(organ_id, {})
+        record['keywords'] = ' '.join(word for words in keywords.values() for word in words)
+        yield organ_id, record
+
+search_index = SearchIndex(search_documents(), SEARCH_FIELD_WEIGHTS)
+# Each process running analyses (the worker, or each analysis pool process) keeps its own index
+near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_SIZE, NEAR_DUPLICATE_DISTANCE) if NEAR_DUPLICATE_SIZE else None
+
+def classify_image_bytes(filename, data, source_size=None):
+    """Decode and classify one uploaded file, returning (organ, confidence).
+
+    source_size is the declared (width, height) of the original of a compact
+    upload (see declared_source_size); features are scaled against it.
+    """
+    from backend.features import ImageFeatures
+    from backend.phash import image_dhash
+    from backend.tiled import needs_tiling
+
+    # Only the header is read here
+    if needs_tiling(PIL.Image.open(io.BytesIO(data)), TILED_MIN_PIXELS):
+        return classify_pages(filename, data)
+    with stage('decode'):
+        image, decoded_size = decode_for_analysis(io.BytesIO(data))
+    if source_size is None:
+        source_size = decoded_size
+    elif decoded_size[0] > source_size[0] or decoded_size[1] > source_size[1]:
+        raise ValueError(f'Image is {decoded_size[0]}x{decoded_size[1]}, larger than its declared '
+                         f'source size {source_size[0]}x{source_size[1]}')
+
+    fingerprint = known = None
+    if near_duplicates is not None:
+        with stage('phash'):
+            fingerprint = image_dhash(image)
+        known = near_duplicates.lookup(fingerprint)
+
+    # A resized or recompressed copy of an image seen before reuses its edge features, skipping Canny
+    features = ImageFeatures(image, source_size, known=known)
+    result = image_processor.smart_detect_organ(filename, features=features)
+    if known is None and fingerprint is not None:
+        computed = features.computed()
+        near_duplicates.add(fingerprint, {name: features[name] for name in NEAR_DUPLICATE_FEATURES if name in computed})
+    return result
+
+def classify_pages(filename, data):
+    """Classify a multi-page, 16-bit or very large scan page by page, tile by tile.
+
+    Each page is summarized by backend.tiled into the features the detection
+    rules read. The organ found with the most total confidence wins, and its
+    confidence is that total over the number of pages, so pages disagreeing lower it.
+    """
+    from backend.features import ImageFeatures
+    from backend.tiled import analyze_pages
+
+    confidences, count = {}, 0
+    pages = analyze_pages(data, ANALYSIS_MAX_SIDE, max_pixels=UPLOAD_MAX_PIXELS, max_mapped_pixels=TILED_MAX_PIXELS,
+                          max_pages=TILED_MAX_PAGES)
+    while True:
+        with stage('decode'):
+            page = next(pages, None)
+        if page is None:
+            break
+        overview, intensity_stats, source_size = page
+        features = ImageFeatures(overview, source_size, known={'intensity_stats': intensity_stats})
+        organ, confidence = image_processor.smart_detect_organ(filename, features=features)
+        confidences[organ] = confidences.get(organ, 0.0) + confidence
+        count += 1
+    organ = max(confidences, key=confidences.get)
+    return organ, confidences[organ] / count
+
+def build_upload_result(organ, confidence):
+    """Response body shared by /api/upload and each /api/upload/batch entry"""
+    organ_data = organ_store.get(organ, ('name', 'emoji', 'description', 'full_description', 'sketchfab_url')) or {}
+    return {
+        'success': True,
+        'part': organ,
+        'confidence': confidence,
+        'model_id': organ,
+        'organ_data': {
+            'name': organ_data.get('name', organ),
+            'emoji': organ_data.get('emoji', '🔍'),
+            'description': organ_data.get('description', ''),
+            'full_description': organ_data.get('full_description', ''),
+            'sketchfab_url': organ_data.get('sketchfab_url', '')
+        },
+        'message': f'ScanSpectrum detection: {organ} with {confidence:.1%} confidence'
+    }
+
+def _init_analysis_worker(progress_queue):
+    # Each pool process already owns a core; keep OpenCV from spawning its own threads
+    import cv2
+    cv2.setNumThreads(1)
+    global _progress_queue
+    _progress_queue = progress_queue
+
+_analysis_pool = None
+_analysis_pool_lock = threading.Lock()
+# Stages completed in pool processes travel back over _progress_queue to the listener
+# registered under the same id in the worker
+_progress_queue = None
+_progress_listeners = {}
+
+def _relay_progress(queue):
+    while True:
+        message = queue.get()
+        if message is None:
+            return
+        listener_id, name, seconds = message
+        listener = _progress_listeners.get(listener_id)
+        if listener is not None:
+            listener(name, seconds)
+
+def get_analysis_pool():
+    """Create the analysis process pool on first use so it is forked inside the serving worker"""
+    global _analysis_pool, _progress_queue
+    with _analysis_pool_lock:
+        if _analysis_pool is None:
+            _progress_queue = multiprocessing.SimpleQueue()
+            threading.Thread(target=_relay_progress, args=(_progress_queue,), name='analysis-progress',
+                             daemon=True).start()
+            _analysis_pool = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS, initializer=_init_analysis_worker,
+                                                 initargs=(_progress_queue,))
+        return _analysis_pool
+
+def reset_analysis_pool():
+    global _analysis_pool
+    with _analysis_pool_lock:
+        if _analysis_pool is not None:
+            _analysis_pool.shutdown(wait=False, cancel_futures=True)
+            _progress_queue.put(None)
+        _analysis_pool = None
+
+def _classify_reporting(listener_id, filename, data, source_size):
+    """classify_image_bytes in a pool process, sending each completed stage back to the worker"""
+    with stage_listener(lambda name, seconds: _progress_queue.put((listener_id, name, seconds))):
+        return classify_image_bytes(filename, data, source_size)
+
+def analyze_upload(filename, data, progress=None, source_size=None):
+    """Classify one upload, in the analysis pool when ANALYSIS_OFFLOAD is on.
+
+    progress(stage, seconds) is called as each pipeline stage completes, wherever it runs.
+    """
+    if not ANALYSIS_OFFLOAD:
+        if progress is None:
+            return classify_image_bytes(filename, data, source_size)
+        with stage_listener(progress):
+            return classify_image_bytes(filename, data, source_size)
+    listener_id = None
+    try:
+        pool = get_analysis_pool()
+        if progress is None:
+            task = (classify_image_bytes, filename, data, source_size)
+        else:
+            listener_id = secrets.token_hex(8)
+            _progress_listeners[listener_id] = progress
+            task = (_classify_reporting, listener_id, filename, data, source_size)
+        # A profiled request samples the pool process too; the request thread only waits
+        recording = g.get('profile') if has_request_context() else None
+        if recording is not None:
+            task = (sample_call, profiler.interval, *task)
+        # The request thread just waits here, so the worker's other threads keep serving
+        result, timings = pool.submit(collect_stages, *task).result()
+        record_stages(timings)
+        if recording is not None:
+            result, stacks = result
+            recording.merge(stacks)
+        return result
+    except BrokenProcessPool:
+        reset_analysis_pool()
+        raise
+    finally:
+        _progress_listeners.pop(listener_id, None)
+
+def declared_source_size(form):
+    """(width, height) of the original a compact upload was downscaled from, or None for a plain upload.
+
+    The browser shrinks an image to ANALYSIS_MAX_SIDE and encodes it grey
+    before sending it (frontend/main.js), declaring the original's size in
+    the source_width and source_height fields so features that depend on
+    scale read as they would for the original.
+    """
+    if 'source_width' not in form and 'source_height' not in form:
+        return None
+    try:
+        width, height = int(form['source_width']), int(form['source_height'])
+    except (KeyError, ValueError):
+        raise BadRequest('source_width and source_height must both be whole numbers')
+    if width <= 0 or height <= 0:
+        raise BadRequest('source_width and source_height must be positive')
+    return width, height
+
+upload_admission = (AdmissionController(ADMISSION_CONCURRENCY, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_TIMEOUT)
+                    if ADMISSION_CONCURRENCY else None)
+
+def upstream_queue_time():
+    """Seconds this request waited before reaching the worker, when the proxy says so"""
+    if not ADMISSION_REQUEST_START_HEADER:
+        return 0.0
+    return upstream_wait(request.headers.get(ADMISSION_REQUEST_START_HEADER))
+
+def analyze_admitted(filename, data, waited=0.0, source_size=None, progress=None):
+    """analyze_upload once upload_admission grants a slot; raises Overloaded when it does not"""
+    if upload_admission is None:
+        return analyze_upload(filename, data, progress, source_size)
+    with stage('queue'):
+        # A request that already waited too long upstream is shed even when a slot is free
+        upload_admission.check(waited)
+        upload_admission.acquire(waited)
+    started = time.perf_counter()
+    try:
+        return analyze_upload(filename, data, progress, source_size)
+    finally:
+        upload_admission.release(time.perf_counter() - started)
+
+def submit_admitted(pool, waited, *task):
+    """pool.submit(*task) holding an upload_admission slot until the task is done; raises Overloaded"""
+    upload_admission.check(waited)
+    upload_admission.acquire(waited)
+    started = time.perf_counter()
+    try:
+        future = pool.submit(*task)
+    except BaseException:
+        upload_admission.release(time.perf_counter() - started)
+        raise
+    future.add_done_callback(lambda future: upload_admission.release(time.perf_counter() - started))
+    return future
+
+def overloaded_response(e):
+    metrics.inc('admission_rejected_total', reason=e.reason)
+    response = jsonify({'success': False, 'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+# Pipeline stages (see backend.metrics.stage) that mark a job's progress
+JOB_PIPELINE_STAGES = {'decode': 'decoded', 'analyze': 'analyzed'}
+
+def run_upload_job(job, filename, data, source_size=None):
+    """/api/upload's work for a background job, reporting progress as pipeline stages complete"""
+    def progress(name, seconds):
+        if name in JOB_PIPELINE_STAGES:
+            analysis_jobs.advance(job, JOB_PIPELINE_STAGES[name])
+
+    def analyze():
+        # A busy server only delays a job: it waits out each Retry-After instead of failing
+        while True:
+            try:
+                return analyze_admitted(filename, data, source_size=source_size, progress=progress)
+            except Overloaded as e:
+                time.sleep(e.retry_after)
+
+    key = ResultCache.make_key(data, filename, source_size)
+    organ, confidence = upload_cache.get_or_compute(key, analyze)
+    return build_upload_result(organ, confidence)
+
+analysis_jobs = JobQueue(run_upload_job, workers=JOBS_WORKERS, max_pending=JOBS_MAX_PENDING,
+                         max_pending_bytes=JOBS_MAX_PENDING_BYTES, ttl=JOBS_RESULT_TTL,
+                         shared=shared_cache('jobs', JOBS_RESULT_TTL))
+
+def load_image_stack():
+    """Import everything image analysis needs without running any of it.
+
+    gunicorn.conf.py calls this in the master under preload_app, so forked
+    workers share the imported modules copy-on-write. OpenCV is deliberately
+    not exercised there: its worker threads would not survive the fork.
+    """
+    import backend.features
+    import backend.gallery
+    from PIL import Image
+    # Register every image plugin now rather than on the first TIFF or WebP upload
+    Image.init()
+
+def _warm_up_analysis():
+    from PIL import Image
+    from backend.features import FEATURES, ImageFeatures
+    from backend.phash import dhash
+
+    load_image_stack()
+    buffer = io.BytesIO()
+    Image.linear_gradient('L').convert('RGB').save(buffer, 'JPEG')
+    data = buffer.getvalue()
+
+    dhash(data)
+    image, source_size = decode_for_analysis(io.BytesIO(data))
+    features = ImageFeatures(image, source_size)
+    for name in FEATURES:
+        features[name]
+    if image_processor.gallery is not None:
+        image_processor.gallery.classify(features['descriptor'])
+
+def warm_up():
+    """Run a synthetic image through decoding, every feature and the gallery, wherever uploads are analyzed.
+
+    Called by each gunicorn worker before it accepts traffic, so the first
+    upload does not pay for OpenCV's and PIL's lazy initialization. Leaves
+    the result cache and the near-duplicate index untouched.
+    """
+    if not ANALYSIS_OFFLOAD:
+        _warm_up_analysis()
+        return
+    pool = get_analysis_pool()
+    for future in [pool.submit(_warm_up_analysis) for _ in range(ANALYSIS_WORKERS)]:
+        future.result()
 
 # HTML Template
 HTML_TEMPLATE = '''
@@ -733,7 +974,8 @@ HTML_TEMPLATE = '''
                     </div>
                     <h3 class="text-xl font-semibold text-gray-700 mb-2">Scan body part using camera</h3>
                     <p class="text-gray-600 mb-6">Position the body part clearly in view for optimal scanning</p>
-                    <button class="bg-green-500 hover:bg-green-600 text-white px-8 py-4 rounded-lg font-medium text-lg shadow-lg transition-all">
+                    <video id="camera-preview" class="hidden mx-auto mb-6 rounded-lg max-w-md w-full" muted playsinline></video>
+                    <button id="start-camera-btn" class="bg-green-500 hover:bg-green-600 text-white px-8 py-4 rounded-lg font-medium text-lg shadow-lg transition-all">
                         Start Camera Scan
                     </button>
                     <p class="text-sm text-gray-500 mt-4">Real-time Analysis • Interactive 3D Models • Educational Content</p>
@@ -819,9 +1061,86 @@ HTML_TEMPLATE = '''
     </main>
 
     <script>
+        // Uploads are shrunk in the browser to the size the server analyzes at (ANALYSIS_MAX_SIDE)
+        // and sent grey, with the original's name and size declared alongside
+        const UPLOAD_MAX_SIDE = {{ upload_max_side }};
+        // Formats every browser decodes to 8 bits as the server would; anything else (TIFF,
+        // DICOM exports) is sent as is for the server's own decoders
+        const COMPACT_UPLOAD_TYPES = ['image/jpeg', 'image/png', 'image/webp', 'image/bmp'];
+
+        // Runs in a worker: decodes, shrinks and greys the image off the main thread.
+        // Answers { blob: null } when the image is already small enough to send as is,
+        // or when maxSide is 0 (the server analyzes at full resolution).
+        function compactImage(file, maxSide) {
+            return createImageBitmap(file, { imageOrientation: 'none' }).then(bitmap => {
+                const sourceWidth = bitmap.width, sourceHeight = bitmap.height;
+                const scale = maxSide ? maxSide / Math.max(sourceWidth, sourceHeight) : 1;
+                if (scale >= 1) {
+                    bitmap.close();
+                    return { blob: null };
+                }
+                const width = Math.max(1, Math.round(sourceWidth * scale));
+                const height = Math.max(1, Math.round(sourceHeight * scale));
+                const canvas = new OffscreenCanvas(width, height);
+                const context = canvas.getContext('2d');
+                context.imageSmoothingQuality = 'high';
+                context.drawImage(bitmap, 0, 0, width, height);
+                bitmap.close();
+
+                // Same weights and rounding as PIL's convert('L') on the server
+                const pixels = context.getImageData(0, 0, width, height);
+                const data = pixels.data;
+                for (let i = 0; i < data.length; i += 4) {
+                    const gray = (data[i] * 19595 + data[i + 1] * 38470 + data[i + 2] * 7471 + 0x8000) >> 16;
+                    data[i] = data[i + 1] = data[i + 2] = gray;
+                }
+                context.putImageData(pixels, 0, 0);
+                // PNG, so the server sees exactly these grey levels
+                return canvas.convertToBlob({ type: 'image/png' })
+                    .then(blob => ({ blob, sourceWidth, sourceHeight }));
+            });
+        }
+
+        // FormData for /api/upload: the compact form when the browser can make it, else the file itself
+        function buildUploadForm(file) {
+            const formData = new FormData();
+            const sendOriginal = () => {
+                formData.append('image', file);
+                return formData;
+            };
+            if (!UPLOAD_MAX_SIDE || !COMPACT_UPLOAD_TYPES.includes(file.type) || !window.Worker || !window.OffscreenCanvas) {
+                return Promise.resolve(sendOriginal());
+            }
+
+            const source = `${compactImage.toString()}
+        self.onmessage = event => compactImage(event.data.file, event.data.maxSide)
+            .then(result => self.postMessage(result), error => self.postMessage({ error: String(error) }));`;
+            const url = URL.createObjectURL(new Blob([source], { type: 'text/javascript' }));
+            const worker = new Worker(url);
+            return new Promise(resolve => {
+                const finish = result => {
+                    worker.terminate();
+                    URL.revokeObjectURL(url);
+                    if (!result || result.error || !result.blob) {
+                        resolve(sendOriginal());
+                        return;
+                    }
+                    formData.append('image', result.blob, 'compact.png');
+                    formData.append('filename', file.name);
+                    formData.append('source_width', result.sourceWidth);
+                    formData.append('source_height', result.sourceHeight);
+                    resolve(formData);
+                };
+                worker.onmessage = event => finish(event.data);
+                worker.onerror = () => finish(null);
+                worker.postMessage({ file, maxSide: UPLOAD_MAX_SIDE });
+            });
+        }
+
         class ScanSpectrumApp {
             constructor() {
                 this.currentUploadMode = 'upload';
+                this.cameraScan = null;
                 this.init();
             }
 
@@ -848,6 +1167,11 @@ HTML_TEMPLATE = '''
                 document.getElementById('image-upload').addEventListener('change', (e) => {
                     this.handleImageUpload(e);
                 });
+
+                // Live camera scan
+                document.getElementById('start-camera-btn').addEventListener('click', () => {
+                    this.cameraScan ? this.stopCameraScan() : this.startCameraScan();
+                });
             }
 
             setUploadMode(mode) {
@@ -856,6 +1180,9 @@ HTML_TEMPLATE = '''
                 // Show/hide appropriate areas
                 document.getElementById('upload-image-area').classList.toggle('hidden', mode !== 'upload');
                 document.getElementById('scan-image-area').classList.toggle('hidden', mode !== 'scan');
+                if (mode !== 'scan' && this.cameraScan) {
+                    this.stopCameraScan();
+                }
             }
 
             showSection(section) {
@@ -913,10 +1240,8 @@ HTML_TEMPLATE = '''
                 console.log('Uploading:', file.name);
                 this.showProcessing(true);
 
-                const formData = new FormData();
-                formData.append('image', file);
-
                 try {
+                    const formData = await buildUploadForm(file);
                     const response = await fetch('/api/upload', {
                         method: 'POST',
                         body: formData
@@ -937,6 +1262,76 @@ HTML_TEMPLATE = '''
                 }
             }
 
+            async startCameraScan() {
+                try {
+                    const stream = await navigator.mediaDevices.getUserMedia({
+                        video: { facingMode: 'environment', width: { ideal: 640 } }
+                    });
+                    const response = await fetch('/api/scan/sessions', { method: 'POST' });
+                    const session = await response.json();
+
+                    const video = document.getElementById('camera-preview');
+                    video.srcObject = stream;
+                    video.classList.remove('hidden');
+                    await video.play();
+
+                    this.cameraScan = { stream, sessionId: session.session_id, seq: 0 };
+                    document.getElementById('start-camera-btn').textContent = 'Stop Camera Scan';
+                    this.sendCameraFrames(this.cameraScan);
+                } catch (error) {
+                    console.error('Camera scan error:', error);
+                    alert('Camera scan failed: ' + error.message);
+                }
+            }
+
+            stopCameraScan() {
+                const scan = this.cameraScan;
+                this.cameraScan = null;
+                scan.stream.getTracks().forEach(track => track.stop());
+                document.getElementById('camera-preview').classList.add('hidden');
+                document.getElementById('start-camera-btn').textContent = 'Start Camera Scan';
+                fetch(`/api/scan/sessions/${scan.sessionId}`, { method: 'DELETE' });
+            }
+
+            async sendCameraFrames(scan) {
+                // Keep one small frame in flight: the server drops rather than queues,
+                // so each request carries the newest capture
+                const video = document.getElementById('camera-preview');
+                const scale = Math.min(1, 320 / Math.max(video.videoWidth, video.videoHeight));
+                const canvas = document.createElement('canvas');
+                canvas.width = Math.round(video.videoWidth * scale);
+                canvas.height = Math.round(video.videoHeight * scale);
+                const context = canvas.getContext('2d');
+                let shownPart = null;
+
+                while (this.cameraScan === scan) {
+                    context.drawImage(video, 0, 0, canvas.width, canvas.height);
+                    const frame = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.7));
+                    const formData = new FormData();
+                    formData.append('frame', frame, 'camera-frame.jpg');
+                    formData.append('seq', scan.seq++);
+
+                    try {
+                        const response = await fetch(`/api/scan/sessions/${scan.sessionId}/frames`, {
+                            method: 'POST',
+                            body: formData
+                        });
+                        const result = await response.json();
+                        if (this.cameraScan === scan && result.part) {
+                            if (result.part !== shownPart) {
+                                shownPart = result.part;
+                                this.displayResults(result);
+                            } else {
+                                document.getElementById('confidence-level').textContent = `AI Confidence: ${Math.round(result.confidence * 100)}%`;
+                            }
+                        }
+                    } catch (error) {
+                        console.error('Frame upload error:', error);
+                    }
+                    await new Promise(resolve => setTimeout(resolve, 100));
+                }
+            }
+
             displayResults(result) {
                 const organData = result.organ_data;
                 
@@ -1005,74 +1400,400 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
+# Frontend files, hashed and compressed once; templates link them with asset_url('main.js')
+assets = AssetManifest(FRONTEND_DIR)
+app.jinja_env.globals['asset_url'] = assets.url
+
+# The page has no per-request variables: render it once and revalidate by content hash.
+# Plain /assets/<name> references in it are pointed at the fingerprinted URLs.
+with app.app_context():
+    INDEX_PAYLOAD = Payload(assets.rewrite(render_template_string(HTML_TEMPLATE, upload_max_side=ANALYSIS_MAX_SIDE)),
+                            'text/html', cache_control='public, no-cache')
+
 @app.route('/')
 def serve_app():
-    return render_template_string(HTML_TEMPLATE)
+    return INDEX_PAYLOAD.make_response()
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    response = assets.make_response(filename)
+    if response is None:
+        return Response('Not found', status=404, mimetype='text/plain')
+    return response
 
 # API Routes
 @app.route('/api/health')
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'ScanSpectrum is running!'})
 
+def json_payload(data):
+    """Serialize data exactly as jsonify would, once, as a cacheable Payload"""
+    return Payload(app.json.response(data).get_data(), 'application/json',
+                   cache_control=f'public, max-age={ORGANS_CACHE_MAX_AGE}')
+
+# Fields returned by /api/organs and /api/organ/<id> when no ?fields= projection is given
+LIST_FIELDS = ('id', *SUMMARY_FIELDS)
+DETAIL_FIELDS = (*SUMMARY_FIELDS, *TEXT_FIELDS)
+
+# The catalogue is fixed for the life of the process, so a response is built once per
+# organ and projection, and only the recently requested ones are kept
+organ_payloads = ResultCache(max_entries=ORGAN_PAYLOAD_CACHE_SIZE, ttl=24 * 3600,
+                             shared=shared_cache(f'organs-{source_version()}-{organ_store.version}-{ORGANS_CACHE_MAX_AGE}',
+                                                 24 * 3600))
+
+def requested_fields(default):
+    """Fields named by ?fields=a,b in catalogue order, or default; ValueError for an unknown name"""
+    value = request.args.get('fields')
+    if not value:
+        return default
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = names.difference(FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown field(s): {", ".join(sorted(unknown))}; expected any of {", ".join(FIELDS)}')
+    return tuple(field for field in FIELDS if field in names)
+
 @app.route('/api/organs')
 def get_organs():
-    organs_list = []
-    for organ_id, data in ORGANS_DATA.items():
-        organs_list.append({
-            'id': organ_id,
-            'name': data['name'],
-            'emoji': data['emoji'],
-            'description': data['description'],
-            'system': data.get('system', 'General'),
-            'color': data.get('color', '#3B82F6'),
-            'animation': data.get('animation', 'pulse'),
-            'model_id': data.get('model_id', organ_id),
-            'sketchfab_url': data.get('sketchfab_url', '')
-        })
-    return jsonify(organs_list)
+    try:
+        fields = requested_fields(LIST_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # List views leave full_description out, so they never read the long-text column
+    payload = organ_payloads.get_or_compute(('organs', fields), lambda: json_payload(organ_store.list(fields)))
+    return payload.make_response()
 
 @app.route('/api/organ/<organ_id>')
 def get_organ(organ_id):
-    organ_data = ORGANS_DATA.get(organ_id)
-    if organ_data:
-        return jsonify(organ_data)
-    else:
+    if organ_id not in organ_store:
         return jsonify({'error': 'Organ not found'}), 404
+    try:
+        fields = requested_fields(DETAIL_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    payload = organ_payloads.get_or_compute(('organ', organ_id, fields),
+                                            lambda: json_payload(organ_store.get(organ_id, fields)))
+    return payload.make_response()
+
+@app.route('/api/search')
+def search_organs():
+    query = request.args.get('q', '').strip()
+    limit = max(0, min(request.args.get('limit', 10, type=int), SEARCH_MAX_RESULTS))
+    with stage('search'):
+        hits, corrections = search_index.search(query, limit=limit)
+    results = []
+    for organ_id, score, matched in hits:
+        summary = organ_store.summary(organ_id)
+        results.append({
+            'id': organ_id,
+            'name': summary['name'],
+            'emoji': summary['emoji'],
+            'system': summary['system'],
+            'description': summary['description'],
+            'score': round(score, 4),
+            'matched': matched,
+        })
+    return jsonify({'query': query, 'corrections': corrections, 'count': len(results), 'results': results})
+
+@app.route('/api/search/suggest')
+def suggest_search():
+    query = request.args.get('q', '')
+    limit = max(0, min(request.args.get('limit', 10, type=int), SEARCH_MAX_RESULTS))
+    return jsonify({'query': query, 'suggestions': search_index.suggest(query, limit=limit)})
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    stats = {'upload': upload_cache.stats(), 'organ_payloads': organ_payloads.stats(), 'jobs': analysis_jobs.stats()}
+    if near_duplicates is not None:
+        stats['near_duplicate'] = near_duplicates.stats()
+    return jsonify(stats)
+
+@app.route('/api/metrics')
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def admin_error():
+    """Error response for a profile admin request that may not proceed, or None if it may"""
+    if profile_store is None or not PROFILE_ADMIN_TOKEN:
+        return jsonify({'success': False, 'error': 'Profiling is not enabled'}), 404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode()):
+        return jsonify({'success': False, 'error': 'Admin token required'}), 401
+    return None
+
+@app.route('/api/admin/profiles')
+def list_profiles():
+    error = admin_error()
+    if error is not None:
+        return error
+    captures = profile_store.list()
+    for capture in captures:
+        capture['download_url'] = url_for('download_profile', capture_id=capture['id'])
+    return jsonify({'success': True, 'profiles': captures})
+
+@app.route('/api/admin/profiles/<capture_id>')
+def download_profile(capture_id):
+    """One captured profile as a speedscope file (default) or collapsed stacks (?format=collapsed)"""
+    error = admin_error()
+    if error is not None:
+        return error
+    capture = profile_store.load(capture_id)
+    if capture is None:
+        return jsonify({'success': False, 'error': 'Unknown profile'}), 404
+    if request.args.get('format') == 'collapsed':
+        response = Response(collapsed(capture['stacks']), mimetype='text/plain')
+        filename = f'{capture_id}.collapsed.txt'
+    else:
+        response = Response(json.dumps(speedscope(capture)), mimetype='application/json')
+        filename = f'{capture_id}.speedscope.json'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
+    """Classify one image, sent as is or in the compact form the web app sends.
+
+    A compact upload is a grey image already shrunk to ANALYSIS_MAX_SIDE, with
+    the original's name in `filename` and its size in source_width and
+    source_height (see declared_source_size); it decodes in a fraction of the
+    time and classifies as the original would.
+    """
+    waited = upstream_queue_time()
     try:
-        if 'image' not in request.files:
+        with stage('parse'):
+            files = request.files
+        if 'image' not in files:
             return jsonify({'success': False, 'error': 'No image file provided'})
        
-        file = request.files['image']
+        file = files['image']
         if file.filename == '':
             return jsonify({'success': False, 'error': 'No file selected'})
        
-        # Process the image
-        image = Image.open(file.stream)
-        
-        # Detect organ
-        organ, confidence = image_processor.smart_detect_organ(file.filename, image)
-        
-        # Get organ data
-        organ_data = ORGANS_DATA.get(organ, {})
+        # A compact upload is sent under a placeholder name with the original's in a field
+        filename = request.form.get('filename') or file.filename
+        source_size = declared_source_size(request.form)
+
+        # Identical uploads (same bytes, filename and declared size) share one analysis; only
+        # one that must be analyzed is subject to admission, so cached results are never shed
+        data = file.read()
+        record_upload_size(file, data)
+        key = ResultCache.make_key(data, filename, source_size)
+        organ, confidence = upload_cache.get_or_compute(key, lambda: analyze_admitted(filename, data, waited, source_size))
        
-        return jsonify({
-            'success': True,
-            'part': organ,
-            'confidence': confidence,
-            'model_id': organ,
-            'organ_data': {
-                'name': organ_data.get('name', organ),
-                'emoji': organ_data.get('emoji', '🔍'),
-                'description': organ_data.get('description', ''),
-                'full_description': organ_data.get('full_description', ''),
-                'sketchfab_url': organ_data.get('sketchfab_url', '')
-            },
-            'message': f'ScanSpectrum detection: {organ} with {confidence:.1%} confidence'
-        })
+        with stage('serialize'):
+            return jsonify(build_upload_result(organ, confidence))
        
+    except Overloaded as e:
+        return overloaded_response(e)
+    except HTTPException as e:
+        # Rejected while streaming the body: too large, not an image, or a decompression bomb
+        return jsonify({'success': False, 'error': e.description}), e.code
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/upload/settings')
+def upload_settings():
+    """What a client needs to send the compact upload form: the longest side to shrink to (0: send as is)"""
+    return jsonify({'success': True, 'max_side': ANALYSIS_MAX_SIDE})
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue an image for background analysis; answers 202 with the job id once the upload is read.
+
+    Follow the job by polling /api/jobs/<id> or on the Server-Sent Events
+    stream /api/jobs/<id>/events, which reports received, decoded, analyzed
+    and finally classified (with the /api/upload result) or failed. Stages a
+    job skips, e.g. decoding a cached upload, are not reported.
+    """
+    try:
+        with stage('parse'):
+            files = request.files
+        if 'image' not in files:
+            return jsonify({'success': False, 'error': 'No image file provided'})
+
+        file = files['image']
+        if file.filename == '':
+            return jsonify({'success': False, 'error': 'No file selected'})
+
+        filename = request.form.get('filename') or file.filename
+        source_size = declared_source_size(request.form)
+        data = file.read()
+        record_upload_size(file, data)
+        job = analysis_jobs.submit(filename, data, source_size, size=len(data))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except HTTPException as e:
+        return jsonify({'success': False, 'error': e.description}), e.code
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    status_url = url_for('get_job', job_id=job.id)
+    response = jsonify({'success': True, 'job_id': job.id, 'status': job.status, 'status_url': status_url,
+                        'events_url': url_for('job_events', job_id=job.id)})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    snapshot = analysis_jobs.get(job_id)
+    if snapshot is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    response = jsonify({'success': True, **snapshot})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's progress, ending after its final event.
+
+    A reconnecting client resumes after the Last-Event-ID it sends. The stream
+    holds a connection open while the job runs, so serve it from gthread
+    workers (SERVING_MODE=threaded); polling works under any worker class.
+    """
+    if analysis_jobs.get(job_id) is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    after = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+
+    def stream():
+        for event in analysis_jobs.events(job_id, after, heartbeat=JOBS_HEARTBEAT):
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            if event['stage'] == 'classified':
+                # The job may have expired (or left the shared cache) since its final event
+                snapshot = analysis_jobs.get(job_id)
+                if snapshot is not None and 'result' in snapshot:
+                    event = {**event, 'result': snapshot['result']}
+                else:
+                    event = {**event, 'error': 'Result expired; upload the image again'}
+            yield f'id: {event["seq"]}\nevent: {event["stage"]}\ndata: {json.dumps(event)}\n\n'
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/upload/batch', methods=['POST'])
+def upload_batch():
+    try:
+        with stage('parse'):
+            files = request.files.getlist('images') or request.files.getlist('image')
+    except HTTPException as e:
+        return jsonify({'success': False, 'error': e.description}), e.code
+    if not files:
+        return jsonify({'success': False, 'error': 'No image files provided'})
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_FILES} files per batch'}), 413
+
+    # Submit every file before waiting on any so the pool works on them concurrently. When
+    # /api/upload shares the pool (ANALYSIS_OFFLOAD), each file takes an admission slot like
+    # an upload would: a batch turned away before any file is submitted is answered 429/503,
+    # and once one file is turned away, the rest are reported busy instead of analyzed.
+    admitted = upload_admission is not None and ANALYSIS_OFFLOAD
+    waited = upstream_queue_time()
+    overloaded = None
+    pending = []
+    try:
+        pool = get_analysis_pool()
+        for file in files:
+            if file.filename == '':
+                pending.append((file.filename, None, None, None, 'No file selected'))
+                continue
+            rejected = getattr(file.stream, 'error', None)
+            if rejected is not None:
+                pending.append((file.filename, None, None, None, rejected.description))
+                continue
+            data = file.read()
+            record_upload_size(file, data)
+            key = ResultCache.make_key(data, file.filename)
+            cached = upload_cache.get(key)
+            if cached is not None:
+                pending.append((file.filename, key, cached, None, None))
+            elif overloaded is not None:
+                pending.append((file.filename, None, None, None, str(overloaded)))
+            elif admitted:
+                try:
+                    future = submit_admitted(pool, waited, collect_stages, classify_image_bytes, file.filename, data)
+                except Overloaded as e:
+                    if not any(entry[3] is not None for entry in pending):
+                        return overloaded_response(e)
+                    overloaded = e
+                    metrics.inc('admission_rejected_total', reason=e.reason)
+                    pending.append((file.filename, None, None, None, str(e)))
+                else:
+                    pending.append((file.filename, key, None, future, None))
+            else:
+                pending.append((file.filename, key, None, pool.submit(collect_stages, classify_image_bytes, file.filename, data), None))
+    except Exception as e:
+        reset_analysis_pool()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    results = []
+    for filename, key, cached, future, error in pending:
+        if error is not None:
+            results.append({'success': False, 'filename': filename, 'error': error})
+            continue
+        try:
+            if cached is not None:
+                organ, confidence = cached
+            else:
+                (organ, confidence), timings = future.result()
+                record_stages(timings)
+                upload_cache.put(key, (organ, confidence))
+        except BrokenProcessPool as e:
+            reset_analysis_pool()
+            results.append({'success': False, 'filename': filename, 'error': str(e)})
+        except Exception as e:
+            results.append({'success': False, 'filename': filename, 'error': str(e)})
+        else:
+            results.append({'filename': filename, **build_upload_result(organ, confidence)})
+
+    return jsonify({'success': True, 'count': len(results), 'results': results})
+
+# Frames share /api/upload's admission slots; one turned away is skipped as busy
+scan_sessions = ScanSessions(analyze_admitted, change_threshold=SCAN_CHANGE_THRESHOLD,
+                             min_interval=SCAN_MIN_INTERVAL, smoothing=SCAN_SMOOTHING, ttl=SCAN_SESSION_TTL)
+
+@app.route('/api/scan/sessions', methods=['POST'])
+def start_scan():
+    session = scan_sessions.create()
+    return jsonify({'success': True, 'session_id': session.id,
+                    'change_threshold': SCAN_CHANGE_THRESHOLD, 'min_interval': SCAN_MIN_INTERVAL})
+
+@app.route('/api/scan/sessions/<session_id>', methods=['DELETE'])
+def end_scan(session_id):
+    return jsonify({'success': scan_sessions.close(session_id)})
+
+@app.route('/api/scan/sessions/<session_id>/frames', methods=['POST'])
+def scan_frame(session_id):
+    """Submit one camera frame; answers at once with the smoothed detection so far.
+
+    The client should keep one frame in flight and send its newest capture
+    next: frames are never queued, and the answer says whether this one was
+    analyzed or why it was skipped (stale, busy, rate, unchanged).
+    """
+    if len(session_id) > 64:
+        return jsonify({'success': False, 'error': 'Invalid session id'}), 400
+    try:
+        with stage('parse'):
+            file = request.files.get('frame')
+        if file is None:
+            return jsonify({'success': False, 'error': 'No frame provided'})
+        seq = request.form.get('seq', type=int)
+        data = file.read()
+        record_upload_size(file, data)
+
+        session = scan_sessions.get(session_id)
+        analyzed, skipped = scan_sessions.submit(session, seq, data, file.filename or 'camera-frame')
+        status = {'session_id': session.id, 'seq': seq, 'analyzed': analyzed, 'skipped': skipped,
+                  'frames': session.frames, 'analyses': session.analyses}
+
+        organ, confidence = session.best()
+        with stage('serialize'):
+            if organ is None:
+                return jsonify({'success': True, 'part': None, **status})
+            return jsonify({**build_upload_result(organ, confidence), **status})
+
+    except HTTPException as e:
+        return jsonify({'success': False, 'error': e.description}), e.code
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
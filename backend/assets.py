@@ -0,0 +1,83 @@
+"""Fingerprinted, precompressed frontend assets.
+
+Every file in the frontend directory (pages excepted) is read once at
+startup, compressed (see Payload) and given a URL carrying a hash of its
+content, e.g. /assets/main.3f9c2a1b7d4e.js. Those URLs never change meaning,
+so they are served `immutable` for a year: a repeat visit fetches nothing but
+the page. The page refers to assets by their plain names (/assets/main.js),
+rewritten to the fingerprinted URLs when it is rendered; the plain names
+stay served too, revalidated on every use, for anything holding one.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+
+from backend.payloads import Payload
+
+# Hex digits of the content hash put in an asset's URL
+FINGERPRINT_LENGTH = 12
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+
+
+class AssetManifest:
+    """The assets of one directory, served under a URL prefix by fingerprinted and plain name"""
+
+    def __init__(self, directory, prefix='/assets/', skip_extensions=('.html',)):
+        self.directory = directory
+        self.prefix = prefix
+        self.urls = {}
+        self._payloads = {}
+        self._plain = {}
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path) or name.startswith('.') or name.endswith(skip_extensions):
+                continue
+            with open(path, 'rb') as f:
+                body = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            payload = Payload(body, mimetype, cache_control=IMMUTABLE)
+            stem, extension = os.path.splitext(name)
+            fingerprinted = f'{stem}.{hashlib.sha256(body).hexdigest()[:FINGERPRINT_LENGTH]}{extension}'
+            self._payloads[fingerprinted] = payload
+            self._plain[name] = payload
+            self.urls[name] = prefix + fingerprinted
+        self._reference = re.compile(
+            '|'.join(re.escape(prefix + name) + r'(?![\w.-])' for name in sorted(self.urls, key=len, reverse=True))
+        ) if self.urls else None
+
+    def __len__(self):
+        return len(self.urls)
+
+    def url(self, name):
+        """Fingerprinted URL of an asset; the plain one for a name that is not in the manifest"""
+        return self.urls.get(name, self.prefix + name)
+
+    def rewrite(self, html):
+        """Point every plain /assets/<name> reference in a page at the fingerprinted URL"""
+        if self._reference is None:
+            return html
+        return self._reference.sub(lambda match: self.urls[match.group(0)[len(self.prefix):]], html)
+
+    def make_response(self, filename):
+        """Response for a request under the prefix, or None for an unknown name"""
+        payload = self._payloads.get(filename)
+        if payload is not None:
+            return payload.make_response()
+        payload = self._plain.get(filename)
+        if payload is None:
+            return None
+        response = payload.make_response()
+        response.headers['Cache-Control'] = REVALIDATE
+        return response
+
+    def stats(self):
+        return {
+            name: {
+                'url': url,
+                'bytes': {encoding: len(body) for encoding, body in self._plain[name].variants.items()},
+            }
+            for name, url in self.urls.items()
+        }
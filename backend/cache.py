@@ -0,0 +1,300 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from backend.storage import ThreadConnections
+
+
+class ResultCache:
+    """Bounded LRU cache with per-entry TTL and single-flight computation.
+
+    Entries are small analysis results, so bounding the entry count bounds
+    memory. Concurrent callers asking for the same missing key share one
+    computation instead of each running it. With a `shared` SharedCache,
+    local misses are looked up there before computing, and computed values
+    are written through, so other workers (and later restarts) reuse them.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(data, filename='', source_size=None):
+        """Content address for an upload: its bytes plus the filename (and declared source size) it was sent under"""
+        digest = hashlib.sha256(data)
+        digest.update(b'\0' + filename.encode('utf-8', 'surrogatepass'))
+        if source_size is not None:
+            digest.update(b'\0%dx%d' % source_size)
+        return digest.hexdigest()
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value):
+        # Caller holds the lock
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return self._get_shared(key)
+
+    def put(self, key, value):
+        if self.shared is not None:
+            self.shared.put(key, value)
+        self._put_local(key, value)
+
+    def _get_shared(self, key):
+        # Called without the lock: the shared lookup is I/O
+        value = self.shared.get(key) if self.shared is not None else None
+        if value is not None:
+            self._put_local(key, value)
+        return value
+
+    def _put_local(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, running compute() at most once across threads"""
+        owner = False
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                future = self._in_flight[key] = Future()
+                owner = True
+        if not owner:
+            return future.result()
+
+        try:
+            value = self._get_shared(key)
+            if value is None:
+                value = compute()
+                self.put(key, value)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
+
+
+class SharedCache:
+    """Host-local cache shared by every worker process and kept across restarts, in SQLite.
+
+    Values are pickled into one table of a WAL-mode database: readers never
+    block the writer, and every write is a single atomic transaction, so
+    concurrent workers only ever see whole entries. A trigger-maintained
+    counter tracks the stored bytes; once a write takes it past max_bytes,
+    expired and then least recently used entries are deleted. Last-use times
+    are refreshed at most every touch_interval seconds, so hits rarely write.
+    Errors (a locked or full disk) count as misses rather than failing the caller,
+    and an entry that no longer unpickles (its class has changed) is deleted.
+
+    Values are unpickled, so the database must live where only this service can write.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+        'size INTEGER NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS entries_used ON entries (used)',
+        'CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO totals VALUES (0, 0)',
+        'CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries '
+        'BEGIN UPDATE totals SET bytes = bytes + new.size; END',
+        'CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries '
+        'BEGIN UPDATE totals SET bytes = bytes + new.size - old.size; END',
+        'CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries '
+        'BEGIN UPDATE totals SET bytes = bytes - old.size; END',
+    ]
+
+    def __init__(self, path, namespace='', max_bytes=256 * 1024 * 1024, ttl=3600, touch_interval=60):
+        self.path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self._connections = ThreadConnections(self._connect)
+        self._counts_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        with self._transaction(connection):
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+        return connection
+
+    @staticmethod
+    @contextmanager
+    def _transaction(connection):
+        # Take the write lock up front so two writers never deadlock upgrading from a read
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _count(self, counter, amount=1):
+        with self._counts_lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _key(self, key):
+        return f'{self.namespace}:{key!r}'
+
+    def get(self, key):
+        now = time.time()
+        try:
+            connection = self._connections.get()
+            row = connection.execute('SELECT value, expires, used FROM entries WHERE key = ?',
+                                     (self._key(key),)).fetchone()
+            if row is None or row[1] < now:
+                self._count('misses')
+                return None
+            if now - row[2] > self.touch_interval:
+                connection.execute('UPDATE entries SET used = ? WHERE key = ?', (now, self._key(key)))
+        except sqlite3.Error:
+            self._count('errors')
+            return None
+        try:
+            value = pickle.loads(row[0])
+        except Exception:
+            # Unpicklable here (e.g. a class that has since changed): drop it so it is recomputed
+            self._count('errors')
+            self.delete(key)
+            return None
+        self._count('hits')
+        return value
+
+    def delete(self, key):
+        try:
+            connection = self._connections.get()
+            with self._transaction(connection):
+                connection.execute('DELETE FROM entries WHERE key = ?', (self._key(key),))
+        except sqlite3.Error:
+            self._count('errors')
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            connection = self._connections.get()
+            with self._transaction(connection):
+                connection.execute(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                    'value = excluded.value, size = excluded.size, expires = excluded.expires, used = excluded.used',
+                    (self._key(key), blob, len(blob), now + self.ttl, now))
+                if self._stored_bytes(connection) > self.max_bytes:
+                    self._evict(connection, now)
+        except sqlite3.Error:
+            self._count('errors')
+
+    @staticmethod
+    def _stored_bytes(connection):
+        return connection.execute('SELECT bytes FROM totals').fetchone()[0]
+
+    def _evict(self, connection, now):
+        # Caller holds the write transaction
+        evicted = connection.execute('DELETE FROM entries WHERE expires < ?', (now,)).rowcount
+        while self._stored_bytes(connection) > self.max_bytes:
+            deleted = connection.execute('DELETE FROM entries WHERE key IN '
+                                         '(SELECT key FROM entries ORDER BY used LIMIT 16)').rowcount
+            if not deleted:
+                break
+            evicted += deleted
+        self._count('evictions', evicted)
+
+    def stats(self):
+        """This process's lookups, plus the size of the store all processes share"""
+        with self._counts_lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'path': self.path,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+        try:
+            connection = self._connections.get()
+            stats['entries'] = connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            stats['bytes'] = self._stored_bytes(connection)
+        except sqlite3.Error:
+            pass
+        stats['file_bytes'] = sum(os.path.getsize(self.path + suffix) for suffix in ('', '-wal', '-shm')
+                                  if os.path.exists(self.path + suffix))
+        return stats
@@ -0,0 +1,115 @@
+import cv2
+import numpy as np
+
+# name -> (dependencies, compute function), filled in by @feature
+FEATURES = {}
+
+
+def feature(*dependencies):
+    """Register a feature computed from the named features it depends on"""
+    def register(fn):
+        FEATURES[fn.__name__] = (dependencies, fn)
+        return fn
+    return register
+
+
+class ImageFeatures:
+    """Lazily computed features of one image.
+
+    Each feature is computed on first access, after its dependencies, and
+    cached, so scoring rules only pay for what they read and shared
+    intermediates (the grayscale frame, the edge map) are built once.
+    Values already known (e.g. from a near-duplicate image) can be passed in
+    as `known` and are never recomputed.
+    """
+
+    def __init__(self, image, source_size=None, known=None):
+        self._values = dict(known or {})
+        self._values.update(image=image, source_size=source_size)
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        dependencies, compute = FEATURES[name]
+        value = compute(*(self[dependency] for dependency in dependencies))
+        self._values[name] = value
+        return value
+
+    def computed(self):
+        """Names of the features computed so far"""
+        return [name for name in self._values if name in FEATURES]
+
+
+@feature('image')
+def gray(image):
+    img_array = np.asarray(image)
+    if img_array.ndim == 3:
+        # One conversion straight from PIL's channel order
+        code = cv2.COLOR_RGBA2GRAY if img_array.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+        return cv2.cvtColor(img_array, code)
+    return img_array
+
+
+@feature('gray')
+def size(gray):
+    height, width = gray.shape[:2]
+    return width, height
+
+
+@feature('size', 'source_size')
+def scale(size, source_size):
+    return size[0] / source_size[0] if source_size else 1.0
+
+
+@feature('size')
+def aspect_ratio(size):
+    return size[0] / size[1]
+
+
+@feature('gray')
+def intensity_stats(gray):
+    # Mean and standard deviation in one pass
+    mean, stddev = cv2.meanStdDev(gray)
+    return float(mean[0, 0]), float(stddev[0, 0])
+
+
+@feature('intensity_stats')
+def brightness(intensity_stats):
+    return intensity_stats[0]
+
+
+@feature('intensity_stats')
+def contrast(intensity_stats):
+    return intensity_stats[1]
+
+
+@feature('gray')
+def edges(gray):
+    return cv2.Canny(gray, 50, 150)
+
+
+@feature('edges', 'size', 'scale')
+def edge_density(edges, size, scale):
+    # Edges are thin lines, so their pixel share grows as the image shrinks;
+    # scale back to the density the full-resolution image would have had
+    return cv2.countNonZero(edges) / (size[0] * size[1]) * scale
+
+
+@feature('edges')
+def contour_count(edges):
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return len(contours)
+
+
+@feature('gray')
+def descriptor(gray):
+    """Unit-length appearance vector for gallery matching: 8x8 thumbnail plus 16-bin histogram"""
+    thumbnail = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    thumbnail -= thumbnail.mean()
+    thumbnail /= np.linalg.norm(thumbnail) or 1.0
+    histogram = cv2.calcHist([gray], [0], None, [16], [0, 256]).ravel()
+    histogram = np.sqrt(histogram / max(histogram.sum(), 1.0))
+    vector = np.concatenate([thumbnail, histogram])
+    return vector / (np.linalg.norm(vector) or 1.0)
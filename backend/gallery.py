@@ -0,0 +1,125 @@
+"""Reference-gallery k-nearest-neighbour organ classifier.
+
+A gallery directory holds the descriptor of every labelled reference image:
+
+    vectors.npy   float32 matrix, one unit-length descriptor per row
+    labels.npy    int16 organ index per row
+    organs.json   organ ids, indexed by labels.npy
+
+It is built offline from a directory with one sub-directory of images per
+organ id:
+
+    python -m backend.gallery build references/ gallery/
+
+and memory-mapped at load time, so every gunicorn worker shares one copy
+through the page cache.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from backend.storage import replacing
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp'}
+
+
+class ReferenceGallery:
+    """Cosine-similarity k-NN over a matrix of reference descriptors"""
+
+    def __init__(self, vectors, labels, organs, k=5):
+        self.vectors = vectors
+        self.labels = np.asarray(labels, dtype=np.intp)
+        self.organs = list(organs)
+        self.k = max(1, min(k, len(self.labels)))
+
+    @classmethod
+    def load(cls, directory, k=5):
+        vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(directory, 'labels.npy'))
+        with open(os.path.join(directory, 'organs.json')) as f:
+            organs = json.load(f)
+        return cls(vectors, labels, organs, k=k)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def classify_many(self, descriptors):
+        """[(organ, vote share)] for each row of descriptors, in one matrix product"""
+        queries = np.atleast_2d(np.asarray(descriptors, dtype=np.float32))
+        similarities = queries @ self.vectors.T
+
+        rows = np.arange(len(queries))[:, None]
+        if self.k < similarities.shape[1]:
+            nearest = np.argpartition(similarities, -self.k, axis=1)[:, -self.k:]
+        else:
+            nearest = np.broadcast_to(np.arange(similarities.shape[1]), (len(queries), similarities.shape[1]))
+
+        # Similarity-weighted vote among the k nearest references
+        weights = np.clip(similarities[rows, nearest], 0.0, None)
+        votes = np.zeros((len(queries), len(self.organs)), dtype=np.float32)
+        np.add.at(votes, (np.broadcast_to(rows, nearest.shape), self.labels[nearest]), weights)
+
+        totals = votes.sum(axis=1)
+        best = votes.argmax(axis=1)
+        shares = np.divide(votes[np.arange(len(queries)), best], totals, out=np.zeros_like(totals), where=totals > 0)
+        return [(self.organs[index], float(share)) for index, share in zip(best, shares)]
+
+    def classify(self, descriptor):
+        return self.classify_many(descriptor)[0]
+
+
+def write_gallery(directory, vectors, labels, organs):
+    """Write a gallery directory, swapped into place whole (see replacing)"""
+    with replacing(directory, prefix='.gallery-', directory=True) as staging:
+        np.save(os.path.join(staging, 'vectors.npy'), np.asarray(vectors, dtype=np.float32))
+        np.save(os.path.join(staging, 'labels.npy'), np.asarray(labels, dtype=np.int16))
+        with open(os.path.join(staging, 'organs.json'), 'w') as f:
+            json.dump(list(organs), f)
+
+
+def build_gallery(source, destination):
+    """Describe every image under source/<organ id>/ and write the gallery to destination"""
+    from backend.app import decode_for_analysis, organ_store
+    from backend.features import ImageFeatures
+
+    organs = list(organ_store.ids)
+    vectors, labels, skipped = [], [], 0
+    for organ in organs:
+        folder = os.path.join(source, organ)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            try:
+                with open(os.path.join(folder, name), 'rb') as f:
+                    image, source_size = decode_for_analysis(f)
+                vectors.append(ImageFeatures(image, source_size)['descriptor'])
+                labels.append(organs.index(organ))
+            except Exception as e:
+                skipped += 1
+                print(f'skipping {organ}/{name}: {e}', file=sys.stderr)
+
+    if not vectors:
+        raise SystemExit(f'no reference images found under {source}/<organ id>/')
+    write_gallery(destination, np.vstack(vectors), labels, organs)
+    return len(vectors), skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the reference gallery for k-NN organ classification')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    build = subcommands.add_parser('build', help='describe labelled images into a gallery')
+    build.add_argument('source', help='directory with one sub-directory of images per organ id')
+    build.add_argument('destination', help='gallery directory to write')
+    args = parser.parse_args()
+
+    count, skipped = build_gallery(args.source, args.destination)
+    print(f'wrote {count} references to {args.destination} ({skipped} skipped)')
+
+
+if __name__ == '__main__':
+    main()
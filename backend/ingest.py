@@ -0,0 +1,99 @@
+import io
+
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+from backend.tiled import is_mappable
+
+# Leading bytes identifying each accepted upload format
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+]
+
+# Enough leading bytes to recognise any signature above (WEBP needs 12)
+SIGNATURE_BYTES = 12
+
+
+def sniff_format(head):
+    """Format name for the leading bytes of an upload, or None if unsupported"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+class SniffingUpload(io.BytesIO):
+    """In-memory upload buffer that vets the image header while the body streams in.
+
+    Used as the multipart file stream, so a non-image, an oversized file or a
+    decompression bomb aborts form parsing before the rest of the body is read.
+    The buffered bytes are then decoded directly, with no temp-file spooling.
+    Once the header is parsed ``info`` holds the format, size and mode.
+    An uncompressed TIFF, analyzed in place rather than decoded, is held to
+    ``max_mapped_pixels`` instead of ``max_pixels`` when that is given.
+
+    With ``strict=False`` (batch uploads) a rejection is kept in ``error`` and
+    the rest of that file is discarded unbuffered, so other parts still parse.
+    """
+
+    def __init__(self, max_bytes, max_pixels, sniff_limit=1024 * 1024, strict=True, max_mapped_pixels=None):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.max_mapped_pixels = max_mapped_pixels
+        self.sniff_limit = sniff_limit
+        self.strict = strict
+        self.format = None
+        self.info = None
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None:
+            return len(data)
+        written = super().write(data)
+        length = self.tell()
+        try:
+            if self.max_bytes and length > self.max_bytes:
+                raise RequestEntityTooLarge(f'Image exceeds the {self.max_bytes} byte upload limit')
+            if self.info is None and length <= self.sniff_limit + len(data):
+                self._sniff(length)
+        except (RequestEntityTooLarge, UnsupportedMediaType) as e:
+            if self.strict:
+                raise
+            self.error = e
+            self.seek(0)
+            self.truncate()
+        return written
+
+    def _sniff(self, length):
+        with self.getbuffer() as view:
+            head = bytes(view[:self.sniff_limit])
+        if self.format is None:
+            if length < SIGNATURE_BYTES:
+                return
+            self.format = sniff_format(head)
+            if self.format is None:
+                raise UnsupportedMediaType('Unsupported image format')
+
+        # PIL only parses the header on open; a truncated header just means wait for more bytes
+        try:
+            with Image.open(io.BytesIO(head), formats=[self.format]) as image:
+                width, height = image.size
+                max_pixels = self.max_pixels
+                if self.max_mapped_pixels is not None and is_mappable(image):
+                    max_pixels = self.max_mapped_pixels
+                self.info = {'format': image.format, 'size': image.size, 'mode': image.mode}
+        except Image.DecompressionBombError as e:
+            raise RequestEntityTooLarge(str(e))
+        except (OSError, SyntaxError, ValueError):
+            return
+        if max_pixels and width * height > max_pixels:
+            raise RequestEntityTooLarge(f'Image dimensions {width}x{height} exceed the {max_pixels} pixel limit')
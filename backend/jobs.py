@@ -0,0 +1,223 @@
+import math
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.admission import Overloaded
+
+# Progress a job reports, in order; a stage is reported once, and only after every earlier one seen
+JOB_STAGES = ('received', 'decoded', 'analyzed', 'classified')
+FINAL_STAGES = ('classified', 'failed')
+
+
+class Job:
+    """One background analysis: its progress events and, once finished, its result or error"""
+
+    def __init__(self, job_id, size=0):
+        self.id = job_id
+        self.size = size
+        self.status = 'queued'
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def stage(self):
+        return self.events[-1]['stage'] if self.events else None
+
+    def snapshot(self):
+        """JSON-ready state of the job, also what other workers read from the shared cache"""
+        snapshot = {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'created': self.created,
+            'events': list(self.events),
+        }
+        if self.result is not None:
+            snapshot['result'] = self.result
+        if self.error is not None:
+            snapshot['error'] = self.error
+        return snapshot
+
+
+class JobQueue:
+    """Analyses run in the background by a bounded thread pool, with results kept for a while.
+
+    submit() registers a job and returns at once; run(job, *args) is called
+    on a pool thread, may report progress with advance(), and returns the
+    job's result. At most max_pending jobs, holding at most max_pending_bytes
+    of input between them (each job's `size`), wait or run at a time; beyond
+    that submit() raises Overloaded. Finished jobs are kept for ttl seconds (at
+    most max_jobs of them). With a `shared` SharedCache every change is also
+    written there, so any worker process can report a job another one runs.
+    """
+
+    def __init__(self, run, workers=1, max_pending=32, max_pending_bytes=None, ttl=600, max_jobs=1024, shared=None,
+                 smoothing=0.2):
+        self.run = run
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.shared = shared
+        self.smoothing = smoothing
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = 0
+        self._pending_bytes = 0
+        self._duration = None
+        self._executor = None
+        self._executor_pid = None
+
+    def _pool(self):
+        # Created on first use, so each forked worker runs its own threads
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analysis-job')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(self, *args, size=0):
+        """Queue run(job, *args); `size` is the bytes of input the job holds until it finishes"""
+        executor = self._pool()
+        with self._lock:
+            self._expire()
+            # A job over the byte budget on its own still runs once nothing else is pending
+            over_budget = (self.max_pending_bytes is not None and self._pending
+                           and self._pending_bytes + size > self.max_pending_bytes)
+            if self._pending >= self.max_pending or over_budget:
+                duration = self._duration or 1.0
+                raise Overloaded(429, 'jobs_full', max(1, math.ceil(duration * self._pending / self.workers)))
+            job = Job(secrets.token_urlsafe(16), size)
+            self._jobs[job.id] = job
+            self._pending += 1
+            self._pending_bytes += size
+        self.advance(job, 'received')
+        try:
+            executor.submit(self._run, job, *args)
+        except BaseException as e:
+            # Nothing will run the job (e.g. the pool is shutting down): give its place back
+            self._finish(job, 'failed', error=str(e) or type(e).__name__)
+            raise
+        return job
+
+    def _run(self, job, *args):
+        with self._lock:
+            job.status, job.started = 'running', time.monotonic()
+        self._publish(job)
+        try:
+            result = self.run(job, *args)
+        except Exception as e:
+            self._finish(job, 'failed', error=str(e))
+        else:
+            self._finish(job, 'classified', result=result)
+
+    def advance(self, job, stage, **details):
+        """Record that a job reached a stage; ignored unless it comes after the last one reported"""
+        with self._lock:
+            current = job.stage
+            if current in FINAL_STAGES or current is not None and JOB_STAGES.index(stage) <= JOB_STAGES.index(current):
+                return
+            self._add_event(job, stage, details)
+        self._publish(job)
+
+    def _add_event(self, job, stage, details):
+        # Caller holds the lock
+        job.events.append({'seq': len(job.events) + 1, 'stage': stage, 'at': time.time(), **details})
+        self._changed.notify_all()
+
+    def _finish(self, job, stage, result=None, error=None):
+        with self._lock:
+            job.status = 'done' if stage == 'classified' else 'failed'
+            job.result, job.error = result, error
+            job.finished = time.monotonic()
+            self._pending -= 1
+            self._pending_bytes -= job.size
+            if job.started is not None:
+                elapsed = job.finished - job.started
+                alpha = self.smoothing if self._duration is not None else 1.0
+                self._duration = (1 - alpha) * (self._duration or 0.0) + alpha * elapsed
+            self._add_event(job, stage, {'error': error} if error is not None else {})
+        self._publish(job)
+
+    def _publish(self, job):
+        if self.shared is not None:
+            with self._lock:
+                snapshot = job.snapshot()
+            self.shared.put(job.id, snapshot)
+
+    def _expire(self):
+        # Caller holds the lock; jobs are in submission order, finished or not
+        cutoff = time.monotonic() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < cutoff]:
+            del self._jobs[job_id]
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Snapshot of a job run by this process or, through the shared cache, by another; None if unknown"""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.snapshot()
+        if self.shared is not None:
+            return self.shared.get(job_id)
+        return None
+
+    def events(self, job_id, after=0, heartbeat=15.0, poll_interval=0.25):
+        """Yield a job's events after seq `after` as they happen, ending with its final one.
+
+        Yields None every `heartbeat` seconds without news, so a stream can be
+        kept alive. A job run by another process is followed by polling the
+        shared cache every poll_interval seconds.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        quiet_since = time.monotonic()
+        while True:
+            if job is not None:
+                with self._changed:
+                    self._changed.wait_for(lambda: len(job.events) > after, timeout=heartbeat)
+                    events = job.events[after:]
+            else:
+                snapshot = self.shared.get(job_id) if self.shared is not None else None
+                if snapshot is None:
+                    return
+                events = snapshot['events'][after:]
+                if not events:
+                    time.sleep(poll_interval)
+            for event in events:
+                yield event
+                if event['stage'] in FINAL_STAGES:
+                    return
+            if events:
+                after += len(events)
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= heartbeat:
+                yield None
+                quiet_since = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'max_pending_bytes': self.max_pending_bytes,
+                'pending_bytes': self._pending_bytes,
+                'retained': len(self._jobs),
+                'ttl': self.ttl,
+                'average_seconds': self._duration,
+            }
@@ -0,0 +1,26 @@
+import re
+
+
+class KeywordMatcher:
+    """Finds every keyword occurring anywhere in a string in a single regex pass.
+
+    Equivalent to ``{kw for kw in keywords if kw in text}``. The pattern is a
+    zero-width lookahead over all keywords, longest first, so each position
+    yields the longest keyword starting there; the shorter keywords starting at
+    the same position are exactly its keyword prefixes, which are precomputed.
+    """
+
+    def __init__(self, keywords):
+        keywords = sorted(set(keywords), key=lambda kw: (-len(kw), kw))
+        alternation = '|'.join(re.escape(kw) for kw in keywords)
+        self._pattern = re.compile(f'(?=({alternation}))')
+        self._prefixes = {
+            kw: frozenset(other for other in keywords if kw.startswith(other))
+            for kw in keywords
+        }
+
+    def find(self, text):
+        matched = set()
+        for match in self._pattern.finditer(text):
+            matched |= self._prefixes[match.group(1)]
+        return matched
@@ -0,0 +1,245 @@
+import contextvars
+import glob
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MEGAPIXEL_BUCKETS = (0.1, 0.3, 1, 2, 5, 8, 12, 24, 50, 100)
+BYTES_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2,
+                 10 * 1024 ** 2, 25 * 1024 ** 2)
+
+# Stage durations of the request being handled on this thread; None when not timing
+_stage_timings = contextvars.ContextVar('stage_timings', default=None)
+# Called with (stage, seconds) as each stage of the work on this thread completes; None when unobserved
+_stage_listener = contextvars.ContextVar('stage_listener', default=None)
+
+
+def start_stage_timings():
+    """Begin collecting stage timings for the current request; returns a token for reset"""
+    return _stage_timings.set({})
+
+
+def stop_stage_timings(token):
+    _stage_timings.reset(token)
+
+
+def stage_timings():
+    return _stage_timings.get() or {}
+
+
+@contextmanager
+def stage(name):
+    """Time a block as pipeline stage `name`; a no-op when no request is being timed or observed"""
+    timings = _stage_timings.get()
+    listener = _stage_listener.get()
+    if timings is None and listener is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + seconds
+    # Only stages that completed are reported
+    if listener is not None:
+        listener(name, seconds)
+
+
+@contextmanager
+def stage_listener(listener):
+    """Call listener(stage, seconds) as each stage completes within the block (e.g. to report job progress)"""
+    token = _stage_listener.set(listener)
+    try:
+        yield
+    finally:
+        _stage_listener.reset(token)
+
+
+def record_stages(timings):
+    """Merge stage timings measured elsewhere (e.g. in a pool process) into the current request"""
+    current = _stage_timings.get()
+    if current is not None:
+        for name, seconds in timings.items():
+            current[name] = current.get(name, 0.0) + seconds
+
+
+def collect_stages(fn, *args):
+    """Run fn with its own stage timings, returning (result, timings); used in pool processes"""
+    token = start_stage_timings()
+    try:
+        return fn(*args), dict(stage_timings())
+    finally:
+        stop_stage_timings(token)
+
+
+class Metrics:
+    """Counters, gauges and histograms rendered in the Prometheus text format.
+
+    With a shared `directory`, every process periodically writes a snapshot of
+    its own values there, and rendering sums the snapshots of all processes,
+    so any gunicorn worker can answer a scrape for the whole server. Counters
+    and histograms of exited workers stay in the totals; their gauges are dropped.
+    """
+
+    def __init__(self, prefix, directory=None, flush_interval=1.0):
+        self.prefix = prefix
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._declared = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flusher_pid = None
+
+    def declare(self, name, kind, help_text, buckets=None):
+        self._declared[name] = (kind, help_text, tuple(buckets) if buckets else None)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+            self._mark_dirty()
+
+    def gauge_add(self, name, delta, **labels):
+        self.inc(name, delta, **labels)
+
+    def observe(self, name, value, **labels):
+        buckets = self._declared[name][2]
+        key = self._key(name, labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (non-cumulative), then +Inf, sum
+                series = self._values[key] = [0] * (len(buckets) + 1) + [0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(buckets)] += 1
+            series[-1] += value
+            self._mark_dirty()
+
+    def _mark_dirty(self):
+        # Caller holds the lock
+        self._dirty = True
+        if self.directory and self._flusher_pid != os.getpid():
+            # Started lazily so each forked worker gets its own flusher
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write this process's values to the shared directory, atomically"""
+        if not self.directory:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+            self._dirty = False
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def _merged(self):
+        with self._lock:
+            merged = {key: list(value) if isinstance(value, list) else value
+                      for key, value in self._values.items()}
+        if not self.directory:
+            return merged
+
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(pid)
+            for name, labels, value in snapshot:
+                if self._declared.get(name, ('',))[0] == 'gauge' and not alive:
+                    continue
+                key = (name, tuple(tuple(label) for label in labels))
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = value
+                elif isinstance(current, list):
+                    merged[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = current + value
+        return merged
+
+    def render(self):
+        merged = self._merged()
+        lines = []
+        for name, (kind, help_text, buckets) in self._declared.items():
+            full_name = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {kind}')
+            for (series_name, labels), value in sorted(merged.items()):
+                if series_name != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{full_name}{_labels(labels)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (math.inf,), value):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else _number(bound)
+                    lines.append(f'{full_name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{full_name}_sum{_labels(labels)} {_number(value[-1])}')
+                lines.append(f'{full_name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def server_timing(timings, total):
+    """Server-Timing header value for stage durations in seconds"""
+    parts = [f'{name};dur={seconds * 1e3:.2f}' for name, seconds in timings.items()]
+    parts.append(f'total;dur={total * 1e3:.2f}')
+    return ', '.join(parts)
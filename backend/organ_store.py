@@ -0,0 +1,152 @@
+"""Read-only organ catalogue stored in SQLite.
+
+The content lives in organs.json, an ordered mapping of organ id to its
+fields, and is compiled into a SQLite file:
+
+    python -m backend.organ_store build backend/organs.json backend/organs.sqlite3
+
+The app compiles it on startup when the database is missing or older than
+the JSON. Short fields (name, emoji, summary description, ...) of every organ
+are loaded into memory; long text (full_description) stays on disk and is
+read per request through a memory-mapped connection, so worker memory grows
+with the number of organs only by their summaries.
+"""
+import argparse
+import json
+import os
+import sqlite3
+
+from backend.storage import ThreadConnections, replacing
+
+# Field -> default for organs that leave it out (model_id defaults to the organ id)
+SUMMARY_FIELDS = {
+    'name': None,
+    'emoji': None,
+    'model_id': None,
+    'description': None,
+    'color': '#3B82F6',
+    'system': 'General',
+    'animation': 'pulse',
+    'sketchfab_url': '',
+}
+TEXT_FIELDS = {'full_description': ''}
+FIELDS = ('id', *SUMMARY_FIELDS, *TEXT_FIELDS)
+
+
+class OrganStore:
+    """Organ summaries held in memory, long text read from SQLite on demand"""
+
+    def __init__(self, path, mmap_size=64 * 1024 * 1024):
+        self.path = path
+        self.mmap_size = mmap_size
+        self._connections = ThreadConnections(self._connect)
+        # Changes whenever the file is rebuilt; keys caches of anything derived from the catalogue
+        stat = os.stat(path)
+        self.version = f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+        columns = ', '.join(['id', *SUMMARY_FIELDS])
+        rows = self._connections.get().execute(f'SELECT {columns} FROM organs ORDER BY position').fetchall()
+        self._summaries = {row[0]: dict(zip(SUMMARY_FIELDS, row[1:])) for row in rows}
+        self.ids = list(self._summaries)
+
+    def _connect(self):
+        connection = sqlite3.connect(f'file:{self.path}?mode=ro&immutable=1', uri=True)
+        # Reads go through the shared page cache instead of per-process copies
+        connection.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        return connection
+
+    def __contains__(self, organ_id):
+        return organ_id in self._summaries
+
+    def __len__(self):
+        return len(self.ids)
+
+    def summary(self, organ_id):
+        """Short fields of one organ (shared, do not modify), or None"""
+        return self._summaries.get(organ_id)
+
+    def text(self, organ_id, field='full_description'):
+        if field not in TEXT_FIELDS:
+            raise KeyError(field)
+        row = self._connections.get().execute(f'SELECT {field} FROM organs WHERE id = ?', (organ_id,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, organ_id, fields=FIELDS):
+        """The requested fields of one organ, reading long text only if asked for; None if unknown"""
+        summary = self._summaries.get(organ_id)
+        if summary is None:
+            return None
+        record = {}
+        for field in fields:
+            if field == 'id':
+                record['id'] = organ_id
+            elif field in TEXT_FIELDS:
+                record[field] = self.text(organ_id, field)
+            else:
+                record[field] = summary[field]
+        return record
+
+    def list(self, fields=FIELDS):
+        """The requested fields of every organ in catalogue order"""
+        text_fields = [field for field in fields if field in TEXT_FIELDS]
+        texts = {}
+        if text_fields:
+            # One query for the whole catalogue rather than one per organ
+            query = f'SELECT id, {", ".join(text_fields)} FROM organs'
+            texts = {row[0]: dict(zip(text_fields, row[1:])) for row in self._connections.get().execute(query)}
+        records = []
+        for organ_id in self.ids:
+            summary = self._summaries[organ_id]
+            record = {}
+            for field in fields:
+                if field == 'id':
+                    record['id'] = organ_id
+                elif field in TEXT_FIELDS:
+                    record[field] = texts[organ_id][field]
+                else:
+                    record[field] = summary[field]
+            records.append(record)
+        return records
+
+
+def load_source(source):
+    with open(source, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_store(path, organs):
+    """Write the catalogue database, swapped into place whole (see replacing)"""
+    with replacing(path, prefix='.organs-', suffix='.sqlite3') as staging:
+        connection = sqlite3.connect(staging)
+        columns = ['id', 'position', *SUMMARY_FIELDS, *TEXT_FIELDS]
+        connection.execute(f'CREATE TABLE organs ({", ".join(columns)}, PRIMARY KEY (id)) WITHOUT ROWID')
+        rows = []
+        for position, (organ_id, data) in enumerate(organs.items()):
+            record = {**SUMMARY_FIELDS, **TEXT_FIELDS, 'model_id': organ_id, **data}
+            rows.append((organ_id, position, *(record[field] for field in columns[2:])))
+        connection.executemany(f'INSERT INTO organs VALUES ({", ".join("?" * len(columns))})', rows)
+        connection.commit()
+        connection.close()
+
+
+def open_store(path, source):
+    """Open the catalogue at path, compiling it from source first when it is missing or stale"""
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+        write_store(path, load_source(source))
+    return OrganStore(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the organ catalogue database')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    build = subcommands.add_parser('build', help='compile organs.json into a SQLite catalogue')
+    build.add_argument('source', help='organs.json')
+    build.add_argument('destination', help='SQLite file to write')
+    args = parser.parse_args()
+
+    organs = load_source(args.source)
+    write_store(args.destination, organs)
+    print(f'wrote {len(organs)} organs to {args.destination}')
+
+
+if __name__ == '__main__':
+    main()
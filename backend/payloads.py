@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone is served without it
+    brotli = None
+
+
+class Payload:
+    """A response body serialized once, stored with precompressed variants.
+
+    Serving it costs a content negotiation and a dictionary lookup. Every
+    encoding gets its own strong ETag derived from the content hash, and
+    If-None-Match against any of them answers 304 Not Modified. Range
+    requests (with If-Range) are answered from the negotiated variant.
+    """
+
+    def __init__(self, body, mimetype, cache_control='public, max-age=300'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+
+        # Preferred encodings first: best_match breaks quality ties by this order
+        self.variants = {}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+        self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+        self.variants = {enc: data for enc, data in self.variants.items() if len(data) < len(body)}
+        self.variants['identity'] = body
+
+        self.etags = {
+            enc: self.digest if enc == 'identity' else f'{self.digest}-{enc}'
+            for enc in self.variants
+        }
+
+    @property
+    def body(self):
+        return self.variants['identity']
+
+    def negotiate(self):
+        return request.accept_encodings.best_match(list(self.variants)) or 'identity'
+
+    def not_modified(self):
+        if_none_match = request.if_none_match
+        if not if_none_match:
+            return False
+        return if_none_match.star_tag or any(if_none_match.contains_weak(tag) for tag in self.etags.values())
+
+    def make_response(self, status=200):
+        encoding = self.negotiate()
+        if self.not_modified():
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], status=status, mimetype=self.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(self.etags[encoding])
+        if response.status_code == 200:
+            # Ranges count bytes of the encoded body, which each variant's own ETag identifies
+            response.make_conditional(request, accept_ranges=True, complete_length=len(self.variants[encoding]))
+            response.accept_ranges = 'bytes'
+        response.headers['Cache-Control'] = self.cache_control
+        response.vary.add('Accept-Encoding')
+        return response
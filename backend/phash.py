@@ -0,0 +1,115 @@
+import io
+import threading
+from collections import OrderedDict
+
+# PIL, OpenCV and numpy are imported inside the hashing functions: the index itself
+# is plain Python and is created when the app is imported
+
+# Largest Hamming distance NearDuplicateIndex searches: one more chunk than this per
+# 64-bit hash must still leave at least 4 bits per chunk
+MAX_DISTANCE = 15
+
+
+def dhash(data, decode_side=64):
+    """64-bit difference hash of an encoded image, from a tiny grayscale decode.
+
+    JPEGs are decoded at 1/8 scale or less, so this costs a fraction of a full
+    decode; other formats have no reduced decode, so prefer image_dhash on the
+    image already decoded for analysis.
+    """
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('L', (decode_side, decode_side))
+        return image_dhash(image)
+
+
+def image_dhash(image):
+    """64-bit difference hash of a PIL image.
+
+    Robust to resizing and recompression: each bit says whether a pixel of a
+    9x8 grayscale thumbnail is brighter than its right-hand neighbour.
+    """
+    import cv2
+    import numpy as np
+    gray = np.asarray(image if image.mode == 'L' else image.convert('L'))
+    thumbnail = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class NearDuplicateIndex:
+    """Bounded LRU index of 64-bit perceptual hashes searchable by Hamming distance.
+
+    Uses multi-index hashing: each hash is split into max_distance + 1 chunks,
+    and two hashes within max_distance bits must agree exactly on at least one
+    chunk, so a lookup only compares against entries sharing a chunk value.
+    Chunks of fewer than 4 bits would match almost everything, so max_distance
+    is limited to MAX_DISTANCE.
+    """
+
+    def __init__(self, max_entries=4096, max_distance=6):
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f'max_distance must be between 0 and {MAX_DISTANCE} bits, got {max_distance}')
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        chunks = max_distance + 1
+        bounds = [round(i * 64 / chunks) for i in range(chunks + 1)]
+        self._chunks = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._tables = [{} for _ in self._chunks]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _chunk_values(self, fingerprint):
+        return [(fingerprint >> start) & mask for start, mask in self._chunks]
+
+    def lookup(self, fingerprint):
+        """Value stored for the nearest hash within max_distance, or None"""
+        with self._lock:
+            best, best_distance = None, self.max_distance + 1
+            for table, chunk in zip(self._tables, self._chunk_values(fingerprint)):
+                for candidate in table.get(chunk, ()):
+                    distance = (candidate ^ fingerprint).bit_count()
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            return self._entries[best]
+
+    def add(self, fingerprint, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if fingerprint not in self._entries:
+                for table, chunk in zip(self._tables, self._chunk_values(fingerprint)):
+                    table.setdefault(chunk, set()).add(fingerprint)
+            self._entries[fingerprint] = value
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._remove(evicted)
+                self.evictions += 1
+
+    def _remove(self, fingerprint):
+        # Caller holds the lock
+        for table, chunk in zip(self._tables, self._chunk_values(fingerprint)):
+            bucket = table.get(chunk)
+            bucket.discard(fingerprint)
+            if not bucket:
+                del table[chunk]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
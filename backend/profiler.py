@@ -0,0 +1,217 @@
+"""Stack-sampling profiles of slow or randomly sampled requests.
+
+One background thread per process wakes every `interval` seconds while any
+request is being recorded, reads the Python stacks of the recorded threads
+(sys._current_frames) and counts each distinct stack. Nothing runs while no
+request is recorded, and a request that is neither sampled nor watched for
+slowness is never registered.
+
+A kept recording is written to a ProfileStore directory with its request
+metadata and downloaded as collapsed stacks (flamegraph.pl, speedscope,
+inferno) or as a speedscope JSON file.
+"""
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+
+# Root frame under which stacks sampled in an analysis pool process are filed
+POOL_ROOT = '[analysis pool]'
+
+CAPTURE_ID = re.compile(r'^[0-9]+-[0-9]+-[A-Za-z0-9_-]+$')
+
+
+def frame_label(code):
+    """'function (file.py:first line)', the file relative to its package directory or the repo"""
+    path = code.co_filename
+    for marker in ('/site-packages/', '/dist-packages/'):
+        if marker in path:
+            path = path.rsplit(marker, 1)[1]
+            break
+    else:
+        path = 'backend/' + os.path.basename(path) if '/backend/' in path else os.path.basename(path)
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'
+
+
+def collapse(frame):
+    """Stack of a frame, outermost call first, joined with ';' as in collapsed-stack files"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Recording:
+    """Stack counts sampled from one thread"""
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.started = time.perf_counter()
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def merge(self, stacks, root=POOL_ROOT):
+        """Add stacks sampled elsewhere (e.g. in a pool process) under their own root frame"""
+        for stack, count in stacks.items():
+            self.stacks[f'{root};{stack}'] += count
+
+
+class StackSampler:
+    """Samples the stacks of every recorded thread from one background thread"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._recordings = []
+        self._thread = None
+        self._thread_pid = None
+
+    def record(self, thread_id=None):
+        """Start sampling a thread (the calling one by default); stop() the returned recording"""
+        recording = Recording(thread_id or threading.get_ident())
+        with self._lock:
+            # Started on first use, so each forked worker samples with its own thread
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+            self._recordings.append(recording)
+            self._wake.notify()
+        return recording
+
+    def stop(self, recording):
+        with self._lock:
+            if recording in self._recordings:
+                self._recordings.remove(recording)
+        return recording
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._wake.wait_for(lambda: self._recordings)
+                thread_ids = {recording.thread_id for recording in self._recordings}
+            frames = sys._current_frames()
+            stacks = {thread_id: collapse(frames[thread_id]) for thread_id in thread_ids if thread_id in frames}
+            del frames
+            with self._lock:
+                # Under the lock, so a stopped recording is never added to afterwards
+                for recording in self._recordings:
+                    stack = stacks.get(recording.thread_id)
+                    if stack:
+                        recording.stacks[stack] += 1
+            time.sleep(self.interval)
+
+
+_process_sampler = None
+
+
+def sample_call(interval, fn, *args):
+    """Run fn(*args) while sampling this thread, returning (result, stack counts); used in pool processes"""
+    global _process_sampler
+    if _process_sampler is None or _process_sampler.interval != interval:
+        _process_sampler = StackSampler(interval)
+    recording = _process_sampler.record()
+    try:
+        result = fn(*args)
+    finally:
+        _process_sampler.stop(recording)
+    return result, dict(recording.stacks)
+
+
+def collapsed(stacks):
+    """Collapsed-stack text: one 'frame;frame;frame count' line per distinct stack"""
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+
+
+def speedscope(capture):
+    """A capture as a speedscope (https://www.speedscope.app) sampled profile"""
+    frames, index = [], {}
+    samples, weights = [], []
+    for stack, count in capture['stacks'].items():
+        path = []
+        for label in stack.split(';'):
+            if label not in index:
+                index[label] = len(frames)
+                frames.append({'name': label})
+            path.append(index[label])
+        samples.append(path)
+        weights.append(count * capture['interval'])
+    name = f'{capture["method"]} {capture["path"]} ({capture["duration_ms"]:.0f} ms)'
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'scanspectrum',
+        'activeProfileIndex': 0,
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+
+class ProfileStore:
+    """Captured profiles as JSON files in one directory, shared by every worker; the newest max_captures are kept"""
+
+    def __init__(self, directory, max_captures=50):
+        self.directory = directory
+        self.max_captures = max_captures
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, metadata, stacks):
+        capture_id = f'{time.time_ns()}-{os.getpid()}-{secrets.token_urlsafe(6)}'
+        capture = {'id': capture_id, **metadata, 'stacks': stacks}
+        path = os.path.join(self.directory, capture_id + '.json')
+        staging = path + '.tmp'
+        with open(staging, 'w') as f:
+            json.dump(capture, f)
+        os.replace(staging, path)
+        self._prune()
+        return capture_id
+
+    def _ids(self):
+        # Ids start with the capture time in nanoseconds: newest last
+        ids = [name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json')]
+        return sorted(ids, key=lambda capture_id: int(capture_id.split('-', 1)[0]))
+
+    def _prune(self):
+        ids = self._ids()
+        for capture_id in ids[:max(0, len(ids) - self.max_captures)]:
+            try:
+                os.unlink(os.path.join(self.directory, capture_id + '.json'))
+            except FileNotFoundError:
+                pass  # pruned by another worker
+
+    def load(self, capture_id):
+        """A capture with its stacks, or None for an unknown or malformed id"""
+        if not CAPTURE_ID.match(capture_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, capture_id + '.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def list(self):
+        """Metadata of the kept captures, newest first"""
+        captures = []
+        for capture_id in reversed(self._ids()):
+            capture = self.load(capture_id)
+            if capture is not None:
+                capture.pop('stacks')
+                captures.append(capture)
+        return captures
@@ -0,0 +1,144 @@
+import io
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from backend.admission import Overloaded
+from backend.metrics import stage
+
+
+def frame_thumbnail(data, side=32):
+    """Small grayscale thumbnail of an encoded frame, cheap enough to take for every frame"""
+    # Imported on first use, like backend.phash: sessions are created when the app is imported
+    import cv2
+    import numpy as np
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('L', (side * 2, side * 2))
+        gray = np.asarray(image.convert('L'))
+    return cv2.resize(gray, (side, side), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def frame_change(thumbnail, previous):
+    """Mean absolute grey-level difference between two frame thumbnails"""
+    return float(abs(thumbnail - previous).mean())
+
+
+class ScanSession:
+    """State of one live camera scan: the last analyzed frame and smoothed organ scores"""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.lock = threading.Lock()
+        self.last_seq = -1
+        self.last_thumbnail = None
+        self.last_analyzed_at = 0.0
+        self.last_seen = time.monotonic()
+        self.smoothed = {}
+        self.frames = 0
+        self.analyses = 0
+
+    def best(self):
+        if not self.smoothed:
+            return None, 0.0
+        organ = max(self.smoothed, key=self.smoothed.get)
+        return organ, self.smoothed[organ]
+
+
+class ScanSessions:
+    """Live camera scans, analyzing a frame only when it differs from the last analyzed one.
+
+    Every frame is compared with the last analyzed frame using the mean absolute
+    difference of 32x32 grayscale thumbnails. Frames are skipped when they are
+    older than one already seen (stale), arrive while the session is still
+    analyzing an earlier frame or find the server at capacity (busy: classify
+    raised Overloaded), come sooner than min_interval after the
+    last analysis (rate), or barely changed (unchanged). Detections are smoothed
+    with an exponential moving average, so one odd frame does not flip the answer.
+    """
+
+    def __init__(self, classify, change_threshold=6.0, min_interval=0.2, smoothing=0.4,
+                 max_sessions=256, ttl=300):
+        self.classify = classify
+        self.change_threshold = change_threshold
+        self.min_interval = min_interval
+        self.smoothing = smoothing
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self):
+        return self.get(secrets.token_urlsafe(12))
+
+    def get(self, session_id):
+        """The session with this id, starting a fresh one if this process has none.
+
+        Sessions live in the worker process; a frame routed to another worker
+        starts over there (no gating baseline, no smoothing history) instead of failing.
+        """
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = ScanSession(session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            session.last_seen = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def close(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _expire(self):
+        # Caller holds the lock
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_seen >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+
+    def submit(self, session, seq, data, filename):
+        """Process one frame; returns (analyzed, skip reason or None)"""
+        # Never queue: a frame arriving during an analysis is dropped, the client sends a fresher one
+        if not session.lock.acquire(blocking=False):
+            return False, 'busy'
+        try:
+            session.frames += 1
+            if seq is not None:
+                if seq <= session.last_seq:
+                    return False, 'stale'
+                session.last_seq = seq
+
+            now = time.monotonic()
+            if session.analyses and now - session.last_analyzed_at < self.min_interval:
+                return False, 'rate'
+
+            with stage('gate'):
+                thumbnail = frame_thumbnail(data)
+                unchanged = (session.last_thumbnail is not None and
+                             frame_change(thumbnail, session.last_thumbnail) < self.change_threshold)
+            if unchanged:
+                return False, 'unchanged'
+
+            try:
+                organ, confidence = self.classify(filename, data)
+            except Overloaded:
+                return False, 'busy'
+            session.last_thumbnail = thumbnail
+            session.last_analyzed_at = now
+            session.analyses += 1
+            self._smooth(session, organ, confidence)
+            return True, None
+        finally:
+            session.lock.release()
+
+    def _smooth(self, session, organ, confidence):
+        alpha = self.smoothing if session.smoothed else 1.0
+        for known in session.smoothed:
+            session.smoothed[known] *= 1 - alpha
+        session.smoothed[organ] = session.smoothed.get(organ, 0.0) + alpha * confidence
@@ -0,0 +1,161 @@
+import bisect
+import math
+import re
+from collections import Counter
+
+TOKEN = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset('''
+    a an and are as at be by for from has have in into is it its of on or that the their this to
+    was were which with within
+'''.split())
+
+
+def tokenize(text):
+    return [term for term in TOKEN.findall(text.lower()) if len(term) > 1 and term not in STOP_WORDS]
+
+
+def trigrams(term):
+    padded = f'${term}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Edit distance between a and b counting an adjacent transposition as one edit
+    (optimal string alignment), or limit + 1 once it is certain to exceed limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class SearchIndex:
+    """Inverted index with BM25 ranking, typo correction and prefix completion.
+
+    Every term maps to its postings, {document: field-weighted term frequency},
+    so a query only touches the postings of the terms it names. Terms missing
+    from the vocabulary are corrected through a trigram index over the
+    vocabulary (candidates sharing trigrams, confirmed by edit distance), and
+    the last query term also matches every vocabulary term it is a prefix of,
+    found by bisecting the sorted vocabulary.
+    """
+
+    def __init__(self, documents, field_weights, k1=1.2, b=0.75, max_expansions=32):
+        """documents: iterable of (document id, {field: text}), in ranking tie-break order"""
+        self.k1 = k1
+        self.b = b
+        self.max_expansions = max_expansions
+        self.postings = {}
+        self.lengths = {}
+        for document, fields in documents:
+            length = 0.0
+            for field, text in fields.items():
+                weight = field_weights[field]
+                for term in tokenize(text):
+                    postings = self.postings.setdefault(term, {})
+                    postings[document] = postings.get(document, 0.0) + weight
+                    length += weight
+            self.lengths[document] = length
+        self.order = {document: position for position, document in enumerate(self.lengths)}
+        self.average_length = sum(self.lengths.values()) / len(self.lengths) if self.lengths else 1.0
+
+        self.vocabulary = sorted(self.postings)
+        self._trigrams = {}
+        for term in self.vocabulary:
+            for gram in trigrams(term):
+                self._trigrams.setdefault(gram, []).append(term)
+
+    def idf(self, term):
+        df = len(self.postings[term])
+        return math.log(1 + (len(self.lengths) - df + 0.5) / (df + 0.5))
+
+    def completions(self, prefix):
+        """Vocabulary terms starting with prefix, most frequent first"""
+        terms = []
+        for index in range(bisect.bisect_left(self.vocabulary, prefix), len(self.vocabulary)):
+            if not self.vocabulary[index].startswith(prefix):
+                break
+            terms.append(self.vocabulary[index])
+        terms.sort(key=lambda term: -len(self.postings[term]))
+        return terms[:self.max_expansions]
+
+    def corrections(self, term):
+        """[(vocabulary term, similarity)] within a small edit distance of a term not in the vocabulary"""
+        if len(term) < 3:
+            return []
+        grams = trigrams(term)
+        shared = Counter(candidate for gram in grams for candidate in self._trigrams.get(gram, ()))
+        limit = 1 if len(term) < 8 else 2
+        found = []
+        for candidate, count in shared.most_common(self.max_expansions * 4):
+            similarity = 2 * count / (len(grams) + len(trigrams(candidate)))
+            if similarity < 0.2:
+                continue
+            distance = edit_distance(term, candidate, limit)
+            if distance <= limit:
+                found.append((candidate, 1 - distance / (len(term) + 1)))
+        # Closest first, then the more common term
+        found.sort(key=lambda item: (-item[1], -len(self.postings[item[0]])))
+        return found[:self.max_expansions]
+
+    def expand(self, term, prefix=False):
+        """Vocabulary terms a query term stands for, each with a similarity weight"""
+        expansions = {}
+        if term in self.postings:
+            expansions[term] = 1.0
+        if prefix:
+            for completion in self.completions(term):
+                # A longer completion is a weaker guess at what is being typed
+                expansions.setdefault(completion, 0.5 + 0.5 * len(term) / len(completion))
+        if not expansions:
+            # Only a term that neither exists nor begins a known one is taken for a typo
+            expansions.update(self.corrections(term))
+        return expansions
+
+    def search(self, query, limit=10, complete=True):
+        """Ranked [(document, score, matched terms)] and {query term: correction} for corrected typos.
+
+        With `complete`, the last query term is treated as a prefix still being typed.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        scores, matched, corrected = {}, {}, {}
+        for position, term in enumerate(terms):
+            expansions = self.expand(term, prefix=complete and position == len(terms) - 1)
+            if expansions and term not in self.postings and not any(e.startswith(term) for e in expansions):
+                corrected[term] = next(iter(expansions))
+            # A query term scores each document by its best expansion, so a prefix matching
+            # many vocabulary terms counts once
+            best = {}
+            for expansion, similarity in expansions.items():
+                idf = self.idf(expansion)
+                for document, frequency in self.postings[expansion].items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[document] / self.average_length)
+                    score = similarity * idf * frequency * (self.k1 + 1) / (frequency + norm)
+                    if score > best.get(document, (0.0, None))[0]:
+                        best[document] = (score, expansion)
+            for document, (score, expansion) in best.items():
+                scores[document] = scores.get(document, 0.0) + score
+                matched.setdefault(document, []).append(expansion)
+
+        ranked = sorted(scores, key=lambda document: (-scores[document], self.order[document]))[:limit]
+        return [(document, scores[document], matched[document]) for document in ranked], corrected
+
+    def suggest(self, query, limit=10):
+        """Completions of the query's last word (typo-corrected when nothing starts with it)"""
+        words = query.lower().split()
+        if not words:
+            return []
+        head, last = words[:-1], ''.join(TOKEN.findall(words[-1]))
+        if not last:
+            return []
+        terms = self.completions(last) or [term for term, _ in self.corrections(last)]
+        return [' '.join(head + [term]) for term in terms[:limit]]
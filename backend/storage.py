@@ -0,0 +1,65 @@
+"""On-disk helpers shared by the SQLite- and file-backed stores."""
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class ThreadConnections:
+    """One connection per thread and process, opened by connect() on first use.
+
+    sqlite3 connections are neither thread- nor fork-safe, so a thread never
+    shares one and a forked worker opens its own rather than using the parent's.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._local = threading.local()
+
+    def get(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._connect()
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+
+@contextmanager
+def replacing(path, prefix, suffix='', directory=False):
+    """Yield a sibling temp file (or directory) to build in, swapped into place at path when the block completes.
+
+    Readers see the old contents or the new, never a partial write; the temp
+    copy is removed if the block fails. A file is swapped in one rename. A
+    directory cannot replace one with contents, so the old one is first renamed
+    aside (a reader opening it in that instant finds nothing) and only deleted
+    once the new one is in place: a crash in between leaves the old one under
+    a `<prefix>old-` name, never loses both.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    if directory:
+        staging = tempfile.mkdtemp(prefix=prefix, suffix=suffix, dir=parent)
+    else:
+        fd, staging = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=parent)
+        os.close(fd)
+    try:
+        yield staging
+        if directory and os.path.exists(path):
+            retired = tempfile.mkdtemp(prefix=prefix + 'old-', dir=parent)
+            aside = os.path.join(retired, 'contents')
+            os.replace(path, aside)
+            try:
+                os.replace(staging, path)
+            except BaseException:
+                os.replace(aside, path)
+                os.rmdir(retired)
+                raise
+            shutil.rmtree(retired)
+        else:
+            os.replace(staging, path)
+    except BaseException:
+        if directory:
+            shutil.rmtree(staging, ignore_errors=True)
+        elif os.path.exists(staging):
+            os.unlink(staging)
+        raise
@@ -0,0 +1,224 @@
+"""Tiled analysis of multi-page, high bit depth and very large scans.
+
+decode_for_analysis turns an upload into one 8-bit grayscale frame: it reads
+only the first page of a TIFF, clips 16-bit samples to 8 bits and
+materializes the whole frame before shrinking it. Here every page is read one
+tile at a time instead, and each tile is folded into two small summaries:
+
+- a histogram of the full-resolution grey levels, which gives the exact
+  brightness and contrast and, for 16-bit data, the window mapped onto 0-255;
+- an area-averaged overview at most max_side pixels on its longest edge,
+  windowed to 8 bits, from which the shape features (edges, contours,
+  gallery descriptor) are computed as for any other upload.
+
+Uncompressed TIFF strips and tiles are viewed in place in the upload buffer,
+or in a memory-mapped file (see map_file), so such a page is never decoded as
+a whole. Compressed pages are decoded one at a time at their native depth.
+Peak memory is one tile plus the overview, or one decoded page.
+"""
+import bisect
+import math
+import mmap
+
+# Longest side of the tiles a page is read in, rounded up to a whole number of overview pixels
+TILE_SIDE = 1024
+
+# Share of samples (in percent) below and above the window a high bit depth page is mapped through
+WINDOW_PERCENTILES = (0.5, 99.5)
+
+# Raw mode of an uncompressed TIFF strip or tile -> (numpy dtype, samples per pixel)
+RAW_LAYOUTS = {
+    'L': ('u1', 1),
+    'RGB': ('u1', 3),
+    'RGBA': ('u1', 4),
+    'RGBX': ('u1', 4),
+    'I;16': ('<u2', 1),
+    'I;16B': ('>u2', 1),
+}
+
+# Modes with more than 8 bits per sample, windowed rather than clipped to 8 bits
+HIGH_DEPTH_MODES = frozenset({'I;16', 'I;16B', 'I;16L', 'I;16N', 'I'})
+
+# Modes a decoded page is read in as is; anything else (palette, CMYK, float) is converted to L
+DECODED_MODES = frozenset({'L', 'RGB', 'RGBA'}) | HIGH_DEPTH_MODES
+
+
+def map_file(path):
+    """Read-only memory map of a file, for analyze_pages on scans too large to read into memory"""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def page_count(image):
+    # Only TIFF pages are scan pages; the frames of an animated GIF or WebP are not
+    return getattr(image, 'n_frames', 1) if image.format == 'TIFF' else 1
+
+
+def is_mappable(image):
+    """Whether the current page is stored uncompressed in a layout that can be viewed in place"""
+    if not image.tile:
+        return False
+    for codec, _, _, args in image.tile:
+        # args: (raw mode, row stride in bytes or 0 for packed rows, orientation)
+        if codec != 'raw' or args[0] not in RAW_LAYOUTS or args[2] != 1:
+            return False
+    return True
+
+
+def needs_tiling(image, min_pixels):
+    """Whether an opened upload should go through analyze_pages rather than decode_for_analysis"""
+    width, height = image.size
+    return (page_count(image) > 1 or image.mode in HIGH_DEPTH_MODES or
+            bool(min_pixels) and width * height > min_pixels and is_mappable(image))
+
+
+class MappedPage:
+    """The current page of an uncompressed TIFF, read from views of its strips or tiles in the file buffer"""
+
+    def __init__(self, image, buffer):
+        import numpy as np
+        self.size = image.size
+        pieces = []
+        for _, (x0, y0, x1, y1), offset, (rawmode, stride, _) in image.tile:
+            dtype, samples = RAW_LAYOUTS[rawmode]
+            dtype = np.dtype(dtype)
+            pixel_bytes = samples * dtype.itemsize
+            row_bytes = stride or (x1 - x0) * pixel_bytes
+            if offset + row_bytes * (y1 - y0 - 1) + (x1 - x0) * pixel_bytes > len(buffer):
+                raise ValueError('Truncated TIFF page')
+            view = np.ndarray((y1 - y0, x1 - x0, samples), dtype, buffer, offset,
+                              (row_bytes, pixel_bytes, dtype.itemsize))
+            pieces.append(((y0, x0, y1, x1), view))
+        pieces.sort(key=lambda piece: piece[0])
+        self.samples = pieces[0][1].shape[2]
+        self.dtype = pieces[0][1].dtype
+        self._pieces = pieces
+        self._starts = [box[0] for box, _ in pieces]
+
+    def region(self, x0, y0, x1, y1):
+        """Pixels of a box, a view when one strip or tile covers it and a copy otherwise"""
+        import numpy as np
+        # Pieces are sorted by top row; those starting below the box cannot overlap it
+        candidates = self._pieces[:bisect.bisect_left(self._starts, y1)]
+        overlapping = [(box, view) for box, view in candidates
+                       if box[2] > y0 and box[0] < y1 and box[3] > x0 and box[1] < x1]
+        if len(overlapping) == 1:
+            (py0, px0, py1, px1), view = overlapping[0]
+            if py0 <= y0 and px0 <= x0 and py1 >= y1 and px1 >= x1:
+                return view[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+        region = np.zeros((y1 - y0, x1 - x0, self.samples), self.dtype)
+        for (py0, px0, py1, px1), view in overlapping:
+            top, left, bottom, right = max(y0, py0), max(x0, px0), min(y1, py1), min(x1, px1)
+            region[top - y0:bottom - y0, left - x0:right - x0] = view[top - py0:bottom - py0, left - px0:right - px0]
+        return region
+
+
+class DecodedPage:
+    """The current page decoded whole, at its native bit depth"""
+
+    def __init__(self, image):
+        self.size = image.size
+        if image.mode not in DECODED_MODES:
+            image = image.convert('L')
+        image.load()
+        self._image = image
+
+    def region(self, x0, y0, x1, y1):
+        import numpy as np
+        # Copy out one tile at a time rather than the whole page next to PIL's own copy
+        return np.asarray(self._image.crop((x0, y0, x1, y1)))
+
+
+def to_gray(region):
+    """Single-channel uint8 or uint16 grey levels of a region, converting colour as features.gray does"""
+    import cv2
+    import numpy as np
+    if region.ndim == 3:
+        if region.shape[2] == 1:
+            region = region[:, :, 0]
+        else:
+            code = cv2.COLOR_RGBA2GRAY if region.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+            return cv2.cvtColor(np.ascontiguousarray(region), code)
+    if region.dtype.kind == 'i':
+        # 32-bit integer pages (16-bit PNGs in older Pillow) hold 16-bit samples
+        return np.clip(region, 0, 65535).astype(np.uint16)
+    if not region.dtype.isnative:
+        return region.astype(region.dtype.newbyteorder('='))
+    return region
+
+
+def block_means(gray, factor):
+    """Mean of each factor x factor block, partial blocks at the edges averaging what they cover"""
+    import numpy as np
+    if factor == 1:
+        return gray.astype(np.float32)
+    height, width = gray.shape
+    rows, columns = np.arange(0, height, factor), np.arange(0, width, factor)
+    sums = np.add.reduceat(np.add.reduceat(gray, rows, axis=0, dtype=np.float64), columns, axis=1)
+    counts = np.outer(np.diff(np.append(rows, height)), np.diff(np.append(columns, width)))
+    return (sums / counts).astype(np.float32)
+
+
+def window(histogram, percentiles=WINDOW_PERCENTILES):
+    """(low, high) grey levels between which the central share of the samples lies"""
+    import numpy as np
+    cumulative = np.cumsum(histogram)
+    total = cumulative[-1]
+    low = int(np.searchsorted(cumulative, total * percentiles[0] / 100, side='right'))
+    high = int(np.searchsorted(cumulative, total * percentiles[1] / 100, side='left'))
+    return low, max(high, low + 1)
+
+
+def analyze_page(page, max_side, tile_side=TILE_SIDE):
+    """(8-bit overview, (mean, standard deviation) of the 8-bit grey levels) of one page"""
+    import numpy as np
+    width, height = page.size
+    factor = math.ceil(max(width, height) / max_side) if max_side else 1
+    step = factor * math.ceil(tile_side / factor)
+
+    overview = np.empty((math.ceil(height / factor), math.ceil(width / factor)), np.float32)
+    histogram = None
+    for y0 in range(0, height, step):
+        for x0 in range(0, width, step):
+            gray = to_gray(page.region(x0, y0, min(x0 + step, width), min(y0 + step, height)))
+            counts = np.bincount(gray.ravel(), minlength=256 if gray.dtype == np.uint8 else 65536)
+            histogram = counts if histogram is None else histogram + counts
+            block = block_means(gray, factor)
+            overview[y0 // factor:y0 // factor + block.shape[0], x0 // factor:x0 // factor + block.shape[1]] = block
+
+    # 8-bit pages keep their grey levels, so the brightness rules read them as for any upload
+    low, high = (0, 255) if len(histogram) == 256 else window(histogram)
+    levels = np.rint(np.clip((np.arange(len(histogram)) - low) * (255 / (high - low)), 0, 255))
+    total = histogram.sum()
+    mean = float((histogram * levels).sum() / total)
+    stddev = float(math.sqrt((histogram * (levels - mean) ** 2).sum() / total))
+
+    overview = np.rint(np.clip((overview - low) * (255 / (high - low)), 0, 255)).astype(np.uint8)
+    return overview, (mean, stddev)
+
+
+def analyze_pages(data, max_side, max_pixels=0, max_mapped_pixels=0, max_pages=0, tile_side=TILE_SIDE):
+    """Yield (8-bit overview, (mean, stddev), source (width, height)) for each page of an encoded scan.
+
+    data is any buffer (bytes, memoryview, mmap). Uncompressed pages are read
+    in place and limited to max_mapped_pixels; pages that must be decoded are
+    limited to max_pixels. max_pages bounds the number of pages read (0 reads all).
+    """
+    import io
+    from PIL import Image
+
+    # A memory map is read through directly; wrapping it in BytesIO would copy it
+    image = Image.open(data if isinstance(data, mmap.mmap) else io.BytesIO(data))
+    count = page_count(image)
+    if max_pages:
+        count = min(count, max_pages)
+    for index in range(count):
+        image.seek(index)
+        width, height = image.size
+        mapped = is_mappable(image)
+        limit = max_mapped_pixels if mapped else max_pixels
+        if limit and width * height > limit:
+            raise ValueError(f'Page {index + 1} dimensions {width}x{height} exceed the {limit} pixel limit')
+        page = MappedPage(image, data) if mapped else DecodedPage(image)
+        overview, stats = analyze_page(page, max_side, tile_side)
+        yield overview, stats, (width, height)
@@ -0,0 +1,93 @@
+"""Benchmark the lazy feature engine against the eager analyze_image_content.
+
+For each synthetic image, checks that the engine's features match the eager
+implementation and times (a) the eager function computing everything and
+(b) the engine computing only what smart_detect_organ's IMAGE_RULES read.
+
+    python benchmarks/bench_features.py [--repeat R]
+"""
+import argparse
+import math
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app import IMAGE_RULES
+from backend.features import ImageFeatures
+
+
+def eager_analyze(image, source_size=None):
+    """analyze_image_content as it was before the feature engine"""
+    img_array = np.array(image)
+    if len(img_array.shape) == 3 and img_array.shape[2] == 3:
+        img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+    height, width = img_array.shape[:2]
+    if len(img_array.shape) == 3:
+        gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = img_array
+    brightness = np.mean(gray)
+    contrast = np.std(gray)
+    edges = cv2.Canny(gray, 50, 150)
+    edge_density = np.sum(edges > 0) / (width * height)
+    scale = width / source_size[0] if source_size else 1.0
+    edge_density *= scale
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return {
+        'aspect_ratio': width / height,
+        'brightness': brightness,
+        'contrast': contrast,
+        'edge_density': edge_density,
+        'contour_count': len(contours),
+        'scale': scale,
+    }
+
+
+def synthetic_image(width, height, mode, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    for i in range(12):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(pixels, center, int(rng.integers(10, max(11, width // 4))), (255, 255, 255), 3)
+    return Image.fromarray(pixels).convert(mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=7)
+    args = parser.parse_args()
+
+    rule_features = [name for name, _, _ in IMAGE_RULES]
+    failures = 0
+    print(f'{"image":>16} {"eager ms":>9} {"lazy ms":>9} {"speedup":>8}')
+    for width, height in [(512, 384), (1600, 1200), (4000, 3000)]:
+        for mode in ['L', 'RGB']:
+            image = synthetic_image(width, height, mode)
+
+            eager = eager_analyze(image)
+            features = ImageFeatures(image)
+            for name, value in eager.items():
+                if not math.isclose(features[name], value, rel_tol=1e-9, abs_tol=1e-9):
+                    failures += 1
+                    print(f'MISMATCH {width}x{height} {mode} {name}: {features[name]} != {value}')
+
+            def run_lazy():
+                features = ImageFeatures(image)
+                for name in rule_features:
+                    features[name]
+
+            eager_s = min(timeit.repeat(lambda: eager_analyze(image), number=1, repeat=args.repeat))
+            lazy_s = min(timeit.repeat(run_lazy, number=1, repeat=args.repeat))
+            print(f'{f"{width}x{height} {mode}":>16} {eager_s * 1e3:9.2f} {lazy_s * 1e3:9.2f} {eager_s / lazy_s:7.2f}x')
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""Latency of reference-gallery k-NN classification at increasing gallery sizes.
+
+Uses random unit-length descriptors written to a temporary memory-mapped
+gallery, so no reference images are needed.
+
+    python benchmarks/bench_gallery.py [--sizes 1000 10000 50000] [--batch 32]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.features import ImageFeatures
+from backend.gallery import ReferenceGallery, write_gallery
+
+
+def random_descriptors(count, dimensions, rng):
+    vectors = rng.standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dimensions = len(ImageFeatures(np.zeros((64, 64), np.uint8))['descriptor'])
+    organs = [f'organ_{i}' for i in range(12)]
+
+    print(f'descriptor: {dimensions} float32')
+    print(f'{"references":>10} {"single ms":>10} {f"batch/{args.batch} ms":>14} {"per query ms":>13}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            directory = os.path.join(tmp, f'gallery-{size}')
+            write_gallery(directory, random_descriptors(size, dimensions, rng),
+                          rng.integers(0, len(organs), size), organs)
+            gallery = ReferenceGallery.load(directory)
+            query = random_descriptors(1, dimensions, rng)[0]
+            batch = random_descriptors(args.batch, dimensions, rng)
+
+            gallery.classify(query)  # fault the memory map in
+            single = min(timeit.repeat(lambda: gallery.classify(query), number=1, repeat=args.repeat))
+            batched = min(timeit.repeat(lambda: gallery.classify_many(batch), number=1, repeat=args.repeat))
+            print(f'{size:>10} {single * 1e3:10.3f} {batched * 1e3:14.3f} {batched / args.batch * 1e3:13.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Per-filename benchmark for smart_detect_organ keyword scoring.
+
+Checks that image_processor.smart_detect_organ, as the app calls it for a
+filename alone, answers exactly what the original per-keyword substring scan
+did (organ and confidence, through the score threshold and the fallback
+rules) over a deterministic corpus of filenames, then times both.
+
+    python benchmarks/bench_keywords.py [--filenames N] [--repeat R]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app import FALLBACK_RULES, KEYWORD_TIER_WEIGHTS, image_processor, organ_store
+
+
+def reference_scores(organ_keywords, filename_lower):
+    """The substring scan smart_detect_organ used before the matcher was compiled"""
+    scores = {organ: 0 for organ in organ_store.ids}
+    for organ, keywords in organ_keywords.items():
+        for keyword in keywords['strong']:
+            if keyword in filename_lower:
+                scores[organ] += 0.5
+        for keyword in keywords['medium']:
+            if keyword in filename_lower:
+                scores[organ] += 0.3
+        for keyword in keywords['weak']:
+            if keyword in filename_lower:
+                scores[organ] += 0.1
+    return scores
+
+
+# fallback_detection's if/elif chain before it became FALLBACK_RULES, kept here so the
+# table cannot drift unnoticed
+REFERENCE_FALLBACK = [
+    (['chest', 'xray', 'thorax'], 'lungs'),
+    (['head', 'brain', 'skull'], 'brain'),
+    (['cardio', 'heart'], 'heart'),
+    (['bone', 'skeleton'], 'skull'),
+    (['eye', 'vision'], 'eye'),
+    (['teeth', 'dental'], 'teeth'),
+    (['stomach', 'digestive'], 'digestive'),
+    (['liver', 'hepatic'], 'liver'),
+    (['ovary', 'female'], 'ovary'),
+    (['male', 'testis'], 'male_reproductive'),
+]
+
+
+def reference_fallback(filename):
+    for words, organ in REFERENCE_FALLBACK:
+        if any(word in filename for word in words):
+            return organ, 0.7
+    organs = ['heart', 'brain', 'lungs', 'digestive', 'liver', 'eye']
+    return organs[zlib.crc32(filename.encode('utf-8', 'surrogatepass')) % len(organs)], 0.6
+
+
+def reference_detect(organ_keywords, filename):
+    """smart_detect_organ for a filename alone, before the matcher was compiled"""
+    filename_lower = filename.lower()
+    scores = reference_scores(organ_keywords, filename_lower)
+    best_organ = max(scores, key=scores.get)
+    if scores[best_organ] < 0.3:
+        return reference_fallback(filename_lower)
+    return best_organ, min(0.7 + (scores[best_organ] * 0.5), 0.95)
+
+
+def build_corpus(count, seed=0):
+    rng = random.Random(seed)
+    vocabulary = sorted(set(image_processor.keyword_hits) | {w for words, _ in FALLBACK_RULES for w in words})
+    corpus = [f'{kw}.jpg' for kw in vocabulary]
+    corpus += ['IMG_20240101_123456.jpg', 'scan.png', '', 'ÜBER_herz.jpeg', 'breathe-breath.png', 'Chest_XRAY.PNG']
+    separators = ['_', '-', ' ', '', '.']
+    while len(corpus) < count:
+        parts = [rng.choice(vocabulary) for _ in range(rng.randint(0, 4))]
+        parts += [''.join(rng.choices(string.ascii_lowercase + string.digits, k=rng.randint(1, 8)))]
+        rng.shuffle(parts)
+        corpus.append(rng.choice(separators).join(parts) + rng.choice(['.jpg', '.png', '.tif']))
+    return corpus[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filenames', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.filenames)
+    keywords = image_processor.organ_keywords
+    assert KEYWORD_TIER_WEIGHTS == {'strong': 0.5, 'medium': 0.3, 'weak': 0.1}
+
+    mismatches = 0
+    for name in corpus:
+        expected, actual = reference_detect(keywords, name), image_processor.smart_detect_organ(name)
+        if actual != expected:
+            mismatches += 1
+            print(f'MISMATCH: {name!r}: {actual} != {expected}')
+    print(f'equivalence: {len(corpus) - mismatches}/{len(corpus)} filenames identical')
+
+    def run_reference():
+        for name in corpus:
+            reference_detect(keywords, name)
+
+    def run_compiled():
+        for name in corpus:
+            image_processor.smart_detect_organ(name)
+
+    for label, fn in [('substring scan', run_reference), ('compiled matcher', run_compiled)]:
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        print(f'{label:>16}: {best / len(corpus) * 1e6:8.2f} us/filename')
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
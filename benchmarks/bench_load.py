@@ -0,0 +1,320 @@
+"""End-to-end load test: throughput and latency of gunicorn as concurrency ramps up.
+
+Boots `gunicorn backend.app:app` locally with gunicorn.conf.py under the
+chosen worker model (or targets a running server with --url). Closed-loop
+clients then drive a weighted mix of the page, catalogue and upload routes,
+each sending its next request as soon as the previous one is answered. The
+client count steps through --concurrency, and every step reports goodput
+(successful responses per second), all responses per second, p50/p95/p99
+latency of the successful ones and the error rate, overall and per route. A
+429 or 503 from admission control is an error, not throughput. The peak and
+the knee are taken from goodput. The knee is the lowest concurrency reaching
+90% of the peak goodput: past it, more clients mostly add latency or rejections.
+
+Uploads are synthetic JPEGs sent under keyword-free filenames. With
+--cold-uploads each upload gets a unique filename and the near-duplicate
+index is turned off, so every upload is analyzed instead of served from cache.
+
+The clients are threads of this process and share the machine with the
+server, so on few cores they cap the throughput they measure. For figures
+that carry over to production, start the server elsewhere and use --url.
+
+    python benchmarks/bench_load.py --mode threaded --workers 2 --concurrency 1 4 16 64
+    python benchmarks/bench_load.py --mix organs=1 --duration 5 --output load.json
+    python benchmarks/bench_load.py --url http://127.0.0.1:8000 --mix upload=1 --cold-uploads
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+ROUTES = ('index', 'organs', 'organ', 'upload')
+DEFAULT_MIX = 'index=1,organs=3,organ=4,upload=2'
+# Share of the peak goodput that marks the knee
+KNEE_SHARE = 0.9
+
+
+def parse_mix(value):
+    """'organs=3,upload=1' -> {'organs': 3.0, 'upload': 1.0}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f'unknown route {name!r}; choose from {", ".join(ROUTES)}')
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('the mix needs a route with a positive weight')
+    return mix
+
+
+def percentile(samples, share):
+    """Nearest-rank percentile of sorted samples"""
+    return samples[min(len(samples) - 1, int(round(share * (len(samples) - 1))))]
+
+
+def multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def start_server(mode, workers, threads, port, cold_uploads, cache_dir, timeout=120):
+    """Boot gunicorn with the repo's config and wait until /api/health answers"""
+    env = dict(os.environ, SERVING_MODE=mode, WEB_CONCURRENCY=str(workers))
+    if threads:
+        env['GUNICORN_THREADS'] = str(threads)
+    if cold_uploads:
+        env['NEAR_DUPLICATE_SIZE'] = '0'
+    # A fresh shared cache, so results from an earlier run are not served
+    env['SHARED_CACHE_DIR'] = cache_dir
+    log = tempfile.TemporaryFile()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', 'backend.app:app'],
+                              cwd=REPO, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    while True:
+        if server.poll() is not None:
+            log.seek(0)
+            raise SystemExit(f'gunicorn exited with status {server.returncode}:\n{log.read().decode(errors="replace")}')
+        if time.perf_counter() - started > timeout:
+            server.terminate()
+            raise SystemExit(f'gunicorn did not answer within {timeout}s')
+        try:
+            with urllib.request.urlopen(base + '/api/health', timeout=1):
+                return server, base
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.05)
+
+
+class Client(threading.Thread):
+    """One closed-loop client on its own keep-alive connection, recording (route, status, seconds, finished at)"""
+
+    def __init__(self, base, plan, stop, seed):
+        super().__init__(daemon=True)
+        url = urllib.parse.urlsplit(base)
+        self.host, self.port = url.hostname, url.port or 80
+        self.plan = plan
+        self.stop = stop
+        self.random = random.Random(seed)
+        self.samples = []
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            self.connection.request(method, path, body, headers or {})
+            response = self.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return None
+        if response.will_close:
+            self.connection.close()
+            self.connection = None
+        return response.status
+
+    def run(self):
+        routes, weights = zip(*self.plan.routes.items())
+        while not self.stop.is_set():
+            route = self.random.choices(routes, weights)[0]
+            method, path, body, headers = self.plan.request(route, self.random)
+            started = time.perf_counter()
+            status = self.request(method, path, body, headers)
+            finished = time.perf_counter()
+            self.samples.append((route, status, finished - started, finished))
+        if self.connection is not None:
+            self.connection.close()
+
+
+class TrafficPlan:
+    """What each route's requests look like: organ ids to pick from, images to upload"""
+
+    def __init__(self, mix, organ_ids, images, cold_uploads):
+        self.routes = {route: weight for route, weight in mix.items() if weight > 0}
+        self.organ_ids = organ_ids
+        self.images = images
+        self.cold_uploads = cold_uploads
+        self._counter = itertools.count()
+
+    def request(self, route, rng):
+        if route == 'index':
+            return 'GET', '/', None, {'Accept-Encoding': 'gzip'}
+        if route == 'organs':
+            return 'GET', '/api/organs', None, {'Accept-Encoding': 'gzip'}
+        if route == 'organ':
+            return 'GET', f'/api/organ/{rng.choice(self.organ_ids)}', None, {'Accept-Encoding': 'gzip'}
+        index = rng.randrange(len(self.images))
+        filename = f'scan-{index}-{next(self._counter)}.jpg' if self.cold_uploads else f'scan-{index}.jpg'
+        body, content_type = multipart('image', filename, self.images[index])
+        return 'POST', '/api/upload', body, {'Content-Type': content_type}
+
+
+def succeeded(status):
+    return status is not None and status < 400
+
+
+def summarize(samples, seconds):
+    """Goodput, throughput, latency percentiles of the successful requests and error rate of a set of samples"""
+    latencies = sorted(elapsed for _, status, elapsed, _ in samples if succeeded(status))
+    errors = sum(1 for _, status, _, _ in samples if not succeeded(status))
+    statuses = {}
+    for _, status, _, _ in samples:
+        key = str(status) if status is not None else 'connection_error'
+        statuses[key] = statuses.get(key, 0) + 1
+    summary = {
+        'requests': len(samples),
+        'goodput_rps': (len(samples) - errors) / seconds,
+        'throughput_rps': len(samples) / seconds,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'statuses': statuses,
+    }
+    if latencies:
+        summary.update(p50_ms=statistics.median(latencies) * 1e3, p95_ms=percentile(latencies, 0.95) * 1e3,
+                       p99_ms=percentile(latencies, 0.99) * 1e3, max_ms=latencies[-1] * 1e3)
+    return summary
+
+
+def run_step(base, plan, concurrency, duration, warmup):
+    """Run `concurrency` clients for warmup + duration seconds; only the last `duration` are measured"""
+    stop = threading.Event()
+    clients = [Client(base, plan, stop, seed=concurrency * 1000 + n) for n in range(concurrency)]
+    for client in clients:
+        client.start()
+    time.sleep(warmup)
+    window_start = time.perf_counter()
+    time.sleep(duration)
+    window_end = time.perf_counter()
+    stop.set()
+    for client in clients:
+        client.join()
+
+    measured = [sample for client in clients for sample in client.samples if window_start <= sample[3] <= window_end]
+    step = {'concurrency': concurrency, **summarize(measured, window_end - window_start), 'routes': {}}
+    for route in plan.routes:
+        step['routes'][route] = summarize([sample for sample in measured if sample[0] == route],
+                                          window_end - window_start)
+    return step
+
+
+def find_knee(steps):
+    """Lowest concurrency whose goodput reaches KNEE_SHARE of the best step's"""
+    peak = max(step['goodput_rps'] for step in steps)
+    return next(step['concurrency'] for step in steps if step['goodput_rps'] >= KNEE_SHARE * peak)
+
+
+def synthetic_uploads(count, width, height):
+    from bench_pipeline import synthetic_image
+    return [synthetic_image(width, height, 'RGB', 'JPEG', seed=seed) for seed in range(count)]
+
+
+def organ_ids(base):
+    with urllib.request.urlopen(base + '/api/organs?fields=id', timeout=30) as response:
+        return [organ['id'] for organ in json.load(response)]
+
+
+def print_report(report):
+    server = report['server']
+    print(f'{server["target"]} mode={server["mode"]} workers={server["workers"]}, mix {report["mix"]}, '
+          f'{report["duration_s"]:g}s per step')
+    print(f'{"clients":>7} {"route":<8} {"ok/s":>9} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+          f'{"errors":>7}')
+    for step in report['steps']:
+        rows = [('all', step)] + list(step['routes'].items())
+        for route, summary in rows:
+            if not summary['requests']:
+                print(f'{step["concurrency"]:>7} {route:<8} {0:9.1f} {0:9.1f} {"-":>9} {"-":>9} {"-":>9} {"-":>7}')
+                continue
+            rates = f'{summary["goodput_rps"]:9.1f} {summary["throughput_rps"]:9.1f}'
+            if 'p50_ms' in summary:
+                latency = f'{summary["p50_ms"]:9.1f} {summary["p95_ms"]:9.1f} {summary["p99_ms"]:9.1f}'
+            else:
+                latency = f'{"-":>9} {"-":>9} {"-":>9}'  # nothing succeeded
+            print(f'{step["concurrency"]:>7} {route:<8} {rates} {latency} {summary["error_rate"]:7.1%}')
+    print(f'peak goodput {report["peak_rps"]:.1f} req/s; knee at {report["knee_concurrency"]} clients '
+          f'({KNEE_SHARE:.0%} of peak)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['sync', 'threaded'], default='sync', help='SERVING_MODE for gunicorn')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers (WEB_CONCURRENCY)')
+    parser.add_argument('--threads', type=int, help='threads per worker in threaded mode (GUNICORN_THREADS)')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--url', help='load a server already running here instead of starting one')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'route weights, default {DEFAULT_MIX}')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='client counts to step through')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds per step')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds at the start of each step')
+    parser.add_argument('--images', type=int, default=8, help='distinct synthetic uploads')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[1920, 1080], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--cold-uploads', action='store_true',
+                        help='unique upload filenames and no near-duplicate index, so every upload is analyzed')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    images = synthetic_uploads(args.images, *args.image_size) if args.mix.get('upload') else []
+    server = None
+    cache_dir = tempfile.TemporaryDirectory(prefix='scanspectrum-load-')
+    if args.url:
+        base = args.url.rstrip('/')
+    else:
+        server, base = start_server(args.mode, args.workers, args.threads, args.port, args.cold_uploads, cache_dir.name)
+    try:
+        plan = TrafficPlan(args.mix, organ_ids(base), images, args.cold_uploads)
+        steps = []
+        for concurrency in args.concurrency:
+            steps.append(run_step(base, plan, concurrency, args.duration, args.warmup))
+            print(f'{concurrency} clients: {steps[-1]["goodput_rps"]:.1f} ok/s, '
+                  f'{steps[-1]["error_rate"]:.1%} errors', file=sys.stderr)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        cache_dir.cleanup()
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'server': {'target': base, 'started': server is not None, 'mode': args.mode if server else 'external',
+                   'workers': args.workers if server else None, 'threads': args.threads},
+        'mix': ','.join(f'{route}={weight:g}' for route, weight in args.mix.items()),
+        'duration_s': args.duration,
+        'warmup_s': args.warmup,
+        'upload_size': args.image_size,
+        'cold_uploads': args.cold_uploads,
+        'steps': steps,
+        'peak_rps': max(step['goodput_rps'] for step in steps),
+        'knee_concurrency': find_knee(steps),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""Per-stage micro-benchmarks for the /api/upload pipeline and the catalogue routes.
+
+Generates deterministic synthetic images (several resolutions; JPEG/PNG;
+RGB/grayscale/RGBA) and times each stage separately: decode, feature analysis,
+organ detection, response serialization and the full request through the
+Flask test client. Reports ops/sec, p50/p99 latency and peak traced
+allocation per stage.
+
+    python benchmarks/bench_pipeline.py --output report.json
+    python benchmarks/bench_pipeline.py --baseline report.json --threshold 0.25
+
+With --baseline the run fails (exit 1) when any stage's p50 is more than
+--threshold slower than in the baseline report.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import app as scan_app
+from backend.cache import ResultCache
+from backend.features import ImageFeatures
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+VARIANTS = [('JPEG', 'RGB'), ('JPEG', 'L'), ('PNG', 'RGB'), ('PNG', 'L'), ('PNG', 'RGBA')]
+QUICK_RESOLUTIONS = [(640, 480), (1920, 1080)]
+
+
+def synthetic_image(width, height, mode, image_format, seed=0):
+    """Encoded bytes of a reproducible image with smooth gradients and sharp outlines"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = ((x * 255 // max(width - 1, 1) + y * 127 // max(height - 1, 1)) % 256).astype(np.uint8)
+    pixels = np.dstack([base, base[::-1], np.flipud(base)])
+    pixels = np.ascontiguousarray(pixels)
+    for _ in range(24):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(8, max(9, min(width, height) // 4)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(pixels, center, radius, color, 2)
+    pixels = np.clip(pixels.astype(np.int16) + rng.integers(-8, 9, pixels.shape), 0, 255).astype(np.uint8)
+
+    image = Image.fromarray(pixels).convert(mode)
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+def measure(fn, iterations, min_time):
+    """Time fn until it has run `iterations` times and for at least min_time seconds"""
+    fn()  # warm up
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < iterations or time.perf_counter() - started < min_time:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    p99_index = min(len(samples) - 1, int(round(0.99 * (len(samples) - 1))))
+    return {
+        'runs': len(samples),
+        'ops_per_sec': len(samples) / sum(samples),
+        'p50_ms': statistics.median(samples) * 1e3,
+        'p99_ms': samples[p99_index] * 1e3,
+        'peak_alloc_kb': peak / 1024,
+    }
+
+
+def upload_stages(name, data, filename):
+    """Callables for each stage of /api/upload on one encoded image"""
+    processor = scan_app.image_processor
+    client = scan_app.app.test_client()
+    image, source_size = scan_app.decode_for_analysis(io.BytesIO(data))
+    organ, confidence = processor.smart_detect_organ(filename, image, source_size)
+    rule_features = [feature for feature, _, _ in scan_app.IMAGE_RULES]
+
+    def decode():
+        scan_app.decode_for_analysis(io.BytesIO(data))
+
+    def analyze():
+        features = ImageFeatures(image, source_size)
+        for feature in rule_features:
+            features[feature]
+
+    def detect():
+        processor.smart_detect_organ(filename, image, source_size)
+
+    def serialize():
+        with scan_app.app.app_context():
+            scan_app.jsonify(scan_app.build_upload_result(organ, confidence)).get_data()
+
+    def request():
+        response = client.post('/api/upload', data={'image': (io.BytesIO(data), filename)},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    return {f'{name}/decode': decode, f'{name}/analyze': analyze, f'{name}/detect': detect,
+            f'{name}/serialize': serialize, f'{name}/request': request}
+
+
+def catalogue_stages():
+    client = scan_app.app.test_client()
+
+    def get(path, **headers):
+        def run():
+            response = client.get(path, headers=headers)
+            assert response.status_code in (200, 304), path
+        return run
+
+    return {
+        'route/index': get('/'),
+        'route/organs': get('/api/organs'),
+        'route/organs_gzip': get('/api/organs', **{'Accept-Encoding': 'gzip'}),
+        'route/organ_detail': get('/api/organ/heart'),
+        'route/health': get('/api/health'),
+    }
+
+
+def compare(report, baseline, threshold):
+    """Stages whose p50 regressed by more than threshold against the baseline"""
+    regressions = []
+    for stage, result in report['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        if change > threshold:
+            regressions.append((stage, before['p50_ms'], result['p50_ms'], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20, help='minimum timed runs per stage')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per stage')
+    parser.add_argument('--quick', action='store_true', help='skip the largest resolution')
+    parser.add_argument('--filter', default='', help='only run stages whose name contains this')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed p50 slowdown, e.g. 0.25 = 25%%')
+    args = parser.parse_args()
+
+    # Every timed request must run the full pipeline, not hit the result cache or near-duplicate index
+    scan_app.upload_cache = ResultCache(max_entries=0)
+    scan_app.near_duplicates = None
+
+    stages = {}
+    for width, height in (QUICK_RESOLUTIONS if args.quick else RESOLUTIONS):
+        for image_format, mode in VARIANTS:
+            data = synthetic_image(width, height, mode, image_format)
+            stages.update(upload_stages(f'{width}x{height}-{image_format}-{mode}', data, 'cardiac_scan.img'))
+    stages.update(catalogue_stages())
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'stages': {},
+    }
+    print(f'{"stage":<34} {"ops/s":>10} {"p50 ms":>9} {"p99 ms":>9} {"peak KiB":>10}')
+    for stage, fn in stages.items():
+        if args.filter not in stage:
+            continue
+        result = report['stages'][stage] = measure(fn, args.iterations, args.min_time)
+        print(f'{stage:<34} {result["ops_per_sec"]:10.1f} {result["p50_ms"]:9.3f} '
+              f'{result["p99_ms"]:9.3f} {result["peak_alloc_kb"]:10.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for stage, before, after, change in regressions:
+            print(f'REGRESSION {stage}: p50 {before:.3f} ms -> {after:.3f} ms (+{change:.0%})')
+        if regressions:
+            return 1
+        print(f'no stage regressed more than {args.threshold:.0%} against {args.baseline}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
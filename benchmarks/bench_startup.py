@@ -0,0 +1,203 @@
+"""Cold-start benchmark: import time, warm-up cost and first-request latency.
+
+Every measurement runs in a fresh interpreter, as a worker would after a spin-down:
+
+    import       time to import backend.app, and whether it loaded OpenCV/numpy
+    cold         first request per route with nothing warmed, then a second upload
+    warm         the same after warm_up(), i.e. what a gunicorn worker sees
+
+With --gunicorn it also boots `gunicorn backend.app:app` with and without
+preloading (GUNICORN_PRELOAD) and reports the time until /api/health answers and the latency of
+the first two uploads over HTTP.
+
+    python benchmarks/bench_startup.py --runs 5 --output startup.json
+    python benchmarks/bench_startup.py --gunicorn --workers 2
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+ROUTES = [('health', '/api/health'), ('organs', '/api/organs'), ('index', '/')]
+
+
+def elapsed_ms(started):
+    return (time.perf_counter() - started) * 1e3
+
+
+def probe(warm, images):
+    """Run inside the fresh interpreter: time the import and the first requests, print JSON"""
+    started = time.perf_counter()
+    from backend import app as scan_app
+    result = {
+        'import_ms': elapsed_ms(started),
+        'image_stack_imported': 'cv2' in sys.modules or 'numpy' in sys.modules,
+    }
+    if warm:
+        started = time.perf_counter()
+        scan_app.warm_up()
+        result['warm_up_ms'] = elapsed_ms(started)
+
+    client = scan_app.app.test_client()
+    for name, path in ROUTES:
+        started = time.perf_counter()
+        client.get(path)
+        result[f'{name}_ms'] = elapsed_ms(started)
+    for name, path in zip(('first_upload', 'second_upload'), images):
+        with open(path, 'rb') as f:
+            started = time.perf_counter()
+            response = client.post('/api/upload', data={'image': (f, os.path.basename(path))},
+                                   content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data(as_text=True)
+        result[f'{name}_ms'] = elapsed_ms(started)
+    print(json.dumps(result))
+
+
+def run_probe(mode, images):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--probe', mode, *images],
+                            check=True, capture_output=True, text=True, cwd=REPO).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def top_imports(count=10):
+    """Slowest imports of backend.app by cumulative time, from python -X importtime"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import backend.app'],
+                            check=True, capture_output=True, text=True, cwd=REPO).stderr
+    # Children are listed before their parent, two spaces deeper per level: keep the
+    # direct imports listed since the previous top-level module, up to backend.app itself
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        depth = (len(module) - len(module.lstrip())) // 2
+        if depth == 0 and module.strip() == 'backend.app':
+            break
+        if depth == 0:
+            timings = []
+        elif depth == 1:
+            timings.append((int(cumulative) / 1e3, module.strip()))
+    return [{'module': module, 'cumulative_ms': ms} for ms, module in sorted(timings, reverse=True)[:count]]
+
+
+def multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def gunicorn_boot(preload, workers, images, port, timeout=120):
+    """Boot gunicorn, wait for /api/health, then time the first uploads over HTTP"""
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0', WEB_CONCURRENCY=str(workers))
+    base = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', 'backend.app:app'],
+                              cwd=REPO, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise SystemExit(f'gunicorn exited with status {server.returncode}')
+            if time.perf_counter() - started > timeout:
+                raise SystemExit(f'gunicorn did not answer within {timeout}s')
+            try:
+                with urllib.request.urlopen(base + '/api/health', timeout=1):
+                    break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+        result = {'preload': preload, 'workers': workers, 'ready_ms': elapsed_ms(started)}
+
+        for name, path in zip(('first_upload', 'second_upload'), images):
+            with open(path, 'rb') as f:
+                body, content_type = multipart('image', os.path.basename(path), f.read())
+            upload = urllib.request.Request(base + '/api/upload', data=body, headers={'Content-Type': content_type})
+            started = time.perf_counter()
+            with urllib.request.urlopen(upload, timeout=30) as response:
+                response.read()
+            result[f'{name}_ms'] = elapsed_ms(started)
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(runs):
+    """Median of every numeric field over the runs"""
+    return {key: statistics.median(run[key] for run in runs) if isinstance(runs[0][key], float) else runs[0][key]
+            for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per measurement')
+    parser.add_argument('--gunicorn', action='store_true', help='also time gunicorn boots with and without preload')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers for --gunicorn')
+    parser.add_argument('--port', type=int, default=8765, help='port for --gunicorn')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--probe', choices=['cold', 'warm'], help=argparse.SUPPRESS)
+    parser.add_argument('images', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.probe == 'warm', args.images)
+        return 0
+
+    import io
+    from PIL import Image
+    from bench_pipeline import synthetic_image
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The second image is mirrored so it hits neither the result cache nor the near-duplicate index
+        first = synthetic_image(1920, 1080, 'RGB', 'JPEG')
+        buffer = io.BytesIO()
+        Image.open(io.BytesIO(first)).transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(buffer, 'JPEG', quality=90)
+        images = []
+        for name, data in (('scan.jpg', first), ('scan-mirrored.jpg', buffer.getvalue())):
+            images.append(os.path.join(directory, name))
+            with open(images[-1], 'wb') as f:
+                f.write(data)
+
+        report = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'top_imports': top_imports(),
+        }
+        for mode in ('cold', 'warm'):
+            report[mode] = summarize([run_probe(mode, images) for _ in range(args.runs)])
+        if args.gunicorn:
+            report['gunicorn'] = [summarize([gunicorn_boot(preload, args.workers, images, args.port)
+                                             for _ in range(args.runs)])
+                                  for preload in (True, False)]
+
+    print(f'import backend.app: {report["cold"]["import_ms"]:.1f} ms '
+          f'(OpenCV/numpy imported: {report["cold"]["image_stack_imported"]})')
+    for entry in report['top_imports']:
+        print(f'  {entry["module"]:<28} {entry["cumulative_ms"]:8.1f} ms')
+    print(f'warm_up(): {report["warm"]["warm_up_ms"]:.1f} ms')
+    print(f'{"first request":<16} {"cold ms":>9} {"warm ms":>9}')
+    for name in [name for name, _ in ROUTES] + ['first_upload', 'second_upload']:
+        print(f'{name:<16} {report["cold"][name + "_ms"]:9.2f} {report["warm"][name + "_ms"]:9.2f}')
+    for boot in report.get('gunicorn', []):
+        print(f'gunicorn preload={boot["preload"]} workers={boot["workers"]}: ready {boot["ready_ms"]:.0f} ms, '
+              f'first upload {boot["first_upload_ms"]:.1f} ms, second {boot["second_upload_ms"]:.1f} ms')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
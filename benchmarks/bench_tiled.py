@@ -0,0 +1,109 @@
+"""Peak memory and time of tiled analysis against decoding the whole page.
+
+Writes a synthetic 16-bit grayscale TIFF (uncompressed, or deflate with
+--compression) and analyzes it in a fresh interpreter per measurement:
+
+    decode   decode_for_analysis, the path 8-bit uploads take
+    tiled    backend.tiled.analyze_pages over the bytes in memory
+    mapped   analyze_pages over a memory map of the file
+
+Memory is the peak resident set during the analysis over the resident set
+before it (Linux: the peak is reset through /proc/self/clear_refs). For
+`mapped` it includes file pages, which the kernel can drop at any time.
+
+    python benchmarks/bench_tiled.py --width 12000 --height 9000 --pages 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+MODES = ('decode', 'tiled', 'mapped')
+
+
+def write_scan(path, width, height, pages, compression):
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = (x * 30000 // max(width - 1, 1) + y * 20000 // max(height - 1, 1)).astype(np.uint16)
+    images = [Image.fromarray(base // (page + 1) + rng.integers(0, 4096, base.shape, dtype=np.uint16))
+              for page in range(pages)]
+    images[0].save(path, 'TIFF', save_all=True, append_images=images[1:], compression=compression)
+
+
+def resident_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f'{field} missing from /proc/self/status')
+
+
+def probe(mode, path):
+    """Run inside the fresh interpreter: analyze the file one way, print JSON"""
+    import io
+    from backend import app as scan_app
+    from backend.tiled import analyze_pages, map_file
+
+    # Imported up front, as a gunicorn worker would have, so only the analysis itself is measured
+    scan_app.load_image_stack()
+    data = map_file(path) if mode == 'mapped' else open(path, 'rb').read()
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')  # reset the peak (VmHWM) to the current resident set
+    before = resident_mb('VmRSS')
+    started = time.perf_counter()
+    if mode == 'decode':
+        scan_app.decode_for_analysis(io.BytesIO(data), scan_app.ANALYSIS_MAX_SIDE)
+        pages = 1
+    else:
+        pages = len(list(analyze_pages(data, scan_app.ANALYSIS_MAX_SIDE)))
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'mode': mode, 'pages': pages, 'ms': elapsed * 1e3, 'peak_growth_mb': resident_mb('VmHWM') - before}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=8000)
+    parser.add_argument('--height', type=int, default=6000)
+    parser.add_argument('--pages', type=int, default=1)
+    parser.add_argument('--compression', default='raw', help="TIFF compression, e.g. raw or tiff_deflate")
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--probe', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('path', nargs='?', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.probe, args.path)
+        return 0
+
+    os.environ['TILED_MAX_PIXELS'] = os.environ['UPLOAD_MAX_PIXELS'] = '0'
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'scan.tif')
+        write_scan(path, args.width, args.height, args.pages, args.compression)
+        report = {'width': args.width, 'height': args.height, 'pages': args.pages,
+                  'compression': args.compression, 'file_mb': os.path.getsize(path) / 2 ** 20, 'runs': []}
+        for mode in MODES:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--probe', mode, path],
+                                    check=True, capture_output=True, text=True, cwd=REPO).stdout
+            report['runs'].append(json.loads(output.splitlines()[-1]))
+
+    print(f'{args.width}x{args.height} 16-bit, {args.pages} page(s), {args.compression}: {report["file_mb"]:.0f} MB')
+    print(f'{"mode":<8} {"pages":>5} {"ms":>9} {"peak MB":>9}')
+    for run in report['runs']:
+        print(f'{run["mode"]:<8} {run["pages"]:>5} {run["ms"]:9.1f} {run["peak_growth_mb"]:9.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,99 @@
 // Complete Scan Spectrum App with 3D Model Integration
+// Uploads are shrunk in the browser to the size the server analyzes at (ANALYSIS_MAX_SIDE
+// in backend/app.py, read from /api/upload/settings) and sent grey, with the original's
+// name and size declared alongside
+// Formats every browser decodes to 8 bits as the server would; anything else (TIFF,
+// DICOM exports) is sent as is for the server's own decoders
+const COMPACT_UPLOAD_TYPES = ['image/jpeg', 'image/png', 'image/webp', 'image/bmp'];
+
+// Runs in a worker: decodes, shrinks and greys the image off the main thread.
+// Answers { blob: null } when the image is already small enough to send as is,
+// or when maxSide is 0 (the server analyzes at full resolution).
+function compactImage(file, maxSide) {
+    return createImageBitmap(file, { imageOrientation: 'none' }).then(bitmap => {
+        const sourceWidth = bitmap.width, sourceHeight = bitmap.height;
+        const scale = maxSide ? maxSide / Math.max(sourceWidth, sourceHeight) : 1;
+        if (scale >= 1) {
+            bitmap.close();
+            return { blob: null };
+        }
+        const width = Math.max(1, Math.round(sourceWidth * scale));
+        const height = Math.max(1, Math.round(sourceHeight * scale));
+        const canvas = new OffscreenCanvas(width, height);
+        const context = canvas.getContext('2d');
+        context.imageSmoothingQuality = 'high';
+        context.drawImage(bitmap, 0, 0, width, height);
+        bitmap.close();
+
+        // Same weights and rounding as PIL's convert('L') on the server
+        const pixels = context.getImageData(0, 0, width, height);
+        const data = pixels.data;
+        for (let i = 0; i < data.length; i += 4) {
+            const gray = (data[i] * 19595 + data[i + 1] * 38470 + data[i + 2] * 7471 + 0x8000) >> 16;
+            data[i] = data[i + 1] = data[i + 2] = gray;
+        }
+        context.putImageData(pixels, 0, 0);
+        // PNG, so the server sees exactly these grey levels
+        return canvas.convertToBlob({ type: 'image/png' })
+            .then(blob => ({ blob, sourceWidth, sourceHeight }));
+    });
+}
+
+// The server's ANALYSIS_MAX_SIDE, fetched once; 0 (full resolution, or unknown) sends files as is
+let uploadMaxSide = null;
+function fetchUploadMaxSide() {
+    if (!uploadMaxSide) {
+        uploadMaxSide = fetch('/api/upload/settings')
+            .then(response => response.ok ? response.json() : {})
+            .then(settings => settings.max_side || 0)
+            .catch(() => {
+                uploadMaxSide = null;  // ask again next time
+                return 0;
+            });
+    }
+    return uploadMaxSide;
+}
+
+// FormData for /api/upload: the compact form when the browser can make it, else the file itself
+async function buildUploadForm(file) {
+    const formData = new FormData();
+    const sendOriginal = () => {
+        formData.append('image', file);
+        return formData;
+    };
+    if (!COMPACT_UPLOAD_TYPES.includes(file.type) || !window.Worker || !window.OffscreenCanvas) {
+        return sendOriginal();
+    }
+    const maxSide = await fetchUploadMaxSide();
+    if (!maxSide) {
+        return sendOriginal();
+    }
+
+    const source = `${compactImage.toString()}
+self.onmessage = event => compactImage(event.data.file, event.data.maxSide)
+    .then(result => self.postMessage(result), error => self.postMessage({ error: String(error) }));`;
+    const url = URL.createObjectURL(new Blob([source], { type: 'text/javascript' }));
+    const worker = new Worker(url);
+    return new Promise(resolve => {
+        const finish = result => {
+            worker.terminate();
+            URL.revokeObjectURL(url);
+            if (!result || result.error || !result.blob) {
+                resolve(sendOriginal());
+                return;
+            }
+            formData.append('image', result.blob, 'compact.png');
+            formData.append('filename', file.name);
+            formData.append('source_width', result.sourceWidth);
+            formData.append('source_height', result.sourceHeight);
+            resolve(formData);
+        };
+        worker.onmessage = event => finish(event.data);
+        worker.onerror = () => finish(null);
+        worker.postMessage({ file, maxSide });
+    });
+}
+
 class ScanSpectrumApp {
     constructor() {
         this.currentSection = 'scan';
@@ -75,8 +170,7 @@ class ScanSpectrumApp {
         document.getElementById('processing-area').classList.remove('hidden');
 
         try {
-            const formData = new FormData();
-            formData.append('image', file);
+            const formData = await buildUploadForm(file);
 
             const response = await fetch('/api/upload', {
                 method: 'POST',
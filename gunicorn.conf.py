@@ -0,0 +1,102 @@
+"""Gunicorn settings, loaded automatically by `gunicorn backend.app:app` from the repo root.
+
+SERVING_MODE=sync (default) keeps gunicorn's stock sync workers; the process
+pools behind /api/upload/batch get an equal share of the cores each.
+
+SERVING_MODE=threaded runs gthread workers so cheap routes (/, /api/organs,
+/api/health) keep answering while uploads are analyzed, and turns on
+ANALYSIS_OFFLOAD so decoding and classification run in a bounded process pool
+rather than on the request threads. The cores are divided between the gunicorn
+workers' pools, and each pool process runs OpenCV single-threaded, so the box
+is never asked for more CPU threads than it has.
+
+Threaded workers admit a bounded number of upload analyses and queue a few
+more briefly (ADMISSION_* in backend/app.py); the rest are answered 429/503
+with Retry-After instead of piling up. A sync worker takes one request at a
+time, so its queue never fills: the backlog builds up in front of it instead,
+and it can only shed requests that already waited there too long, which it
+knows from a proxy's ADMISSION_REQUEST_START_HEADER. The Procfile names the
+X-Request-Start header Heroku's router adds; behind a proxy that adds none,
+use SERVING_MODE=threaded for load shedding. Uploads whose result is cached
+are answered either way.
+
+Background jobs (/api/jobs) are run by a few threads in the worker that took
+the upload; their progress is written to the shared cache, so polling
+/api/jobs/<id> works on any worker. The event stream holds a connection for
+the whole analysis, which ties up a sync worker: use SERVING_MODE=threaded
+for it, or have sync clients poll.
+
+With PROFILE_SLOW_SECONDS or PROFILE_SAMPLE_RATE set, workers also share a
+fresh PROFILE_DIR, so /api/admin/profiles lists the captures of all of them.
+
+Workers share a fresh METRICS_DIR so /api/metrics reports totals for the whole server,
+and a SHARED_CACHE_DIR (kept across restarts, private to this user) holding the
+upload-result and organ-payload cache tier they all read and write.
+
+The app is preloaded (GUNICORN_PRELOAD=0 turns this off): the master imports it
+and the image stack once, then freezes the garbage collector's view of those
+objects, so forked workers share the organ catalogue, the rendered pages and
+the libraries copy-on-write instead of each building their own. Every worker
+then warms OpenCV and PIL with a synthetic image before it accepts requests.
+"""
+import gc
+import os
+import tempfile
+
+cores = os.cpu_count() or 1
+mode = os.environ.get('SERVING_MODE', 'sync')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+preload = os.environ.get('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+# gunicorn's own preload imports the app before -w/--workers is known to any hook, and the
+# app sizes its pools on import; on_starting imports it instead, once the count is final
+preload_app = False
+
+if not os.environ.get('METRICS_DIR'):
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='scanspectrum-metrics-')
+
+profiling = float(os.environ.get('PROFILE_SAMPLE_RATE', 0)) or float(os.environ.get('PROFILE_SLOW_SECONDS', 0))
+if profiling and not os.environ.get('PROFILE_DIR'):
+    os.environ['PROFILE_DIR'] = tempfile.mkdtemp(prefix='scanspectrum-profiles-')
+
+if not os.environ.get('SHARED_CACHE_DIR'):
+    # A stable path so restarts find the cache; private because it holds pickles
+    cache_dir = os.path.join(tempfile.gettempdir(), f'scanspectrum-cache-{os.getuid()}')
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    cache_stat = os.stat(cache_dir)
+    if cache_stat.st_uid != os.getuid() or cache_stat.st_mode & 0o077:
+        raise RuntimeError(f'{cache_dir} must be owned by this user and private to it; set SHARED_CACHE_DIR')
+    os.environ['SHARED_CACHE_DIR'] = cache_dir
+
+if mode == 'threaded':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 16))
+    os.environ.setdefault('ANALYSIS_OFFLOAD', '1')
+elif mode != 'sync':
+    raise ValueError(f'Unknown SERVING_MODE {mode!r}; expected sync or threaded')
+
+
+def on_starting(server):
+    # Every worker has its own analysis pool (uploads when offloaded, /api/upload/batch always),
+    # so the cores are divided between the pools rather than each sized to all of them
+    share = str(max(1, cores // server.cfg.workers))
+    os.environ.setdefault('ANALYSIS_WORKERS', share)
+    if mode == 'sync':
+        # Analysis runs in the workers themselves; split OpenCV's threads between them
+        os.environ.setdefault('CV_NUM_THREADS', share)
+    if preload:
+        import backend.app  # noqa: F401
+
+
+def when_ready(server):
+    if preload:
+        from backend.app import load_image_stack
+        load_image_stack()
+        # Keep the collector from touching (and so copying) the master's objects in every worker
+        gc.collect()
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    from backend.app import warm_up
+    warm_up()